@@ -1,20 +1,28 @@
 #Importing necessary libraries
+#AstroLink, Glueviz, tkinter and matplotlib are only imported by the methods that use them, so that importing AstroGlue
+#stays fast and works on machines without a display
+import contextlib
 import numpy as np
 import pandas as pd
-from glue.core import DataCollection
-from glue_qt.app.application import GlueApplication
-from glue_qt.viewers.scatter import ScatterViewer
-from glue_vispy_viewers.scatter.scatter_viewer import VispyScatterViewer
-from glue_qt.viewers.histogram import HistogramViewer
-from astrolink import AstroLink
-import tkinter as tk
-from tkinter import *
-from tkinter import filedialog, Scrollbar, Canvas
-from tkinter import ttk
-import webbrowser
+from .parallel import RunCancelled, run_astrolink_pool, start_thread
+from .cache import ResultCache
+from .loaders import (array_to_df, astrolink_input, check_float32, column_major, column_slice, load_csv_columns,
+                      load_file, load_npy, preview_file, read_header)
+from .rendering import DensityMapRenderer, OrderedDensityRenderer
+from .lod import LevelOfDetail, stratified_subsample
+from .results import AstroGlueResults, load_astrolink_list, save_astrolink_list
+from .instrument import Tracer
+from .sweep import expand_grid, sweep_astrolink
+from .summary import cluster_summary
+from .hierarchy import ClusterHierarchy
+import json
 import re
 import os.path
 
+#The inputs of set_variables() that are stored in a saved session, besides the file path and data
+SESSION_LISTS = ("feature_spaces", "adaptive_list", "k_den_list", "S_list", "k_link_list", "h_style_list", "workers_list",
+                 "verbose_list", "feature_space_name", "var_plot_list", "type_l")
+
 class AstroGlue:
     """AstroGlue acts as a bridge between AstroLink clustering algorithm and GlueViz data visualization package. 
 
@@ -33,6 +41,10 @@ class AstroGlue:
     Once these inputs are provided, a GlueViz application window automatically launches with the various necessary plots. 
     Using GlueViz, users can perform various kinds of analyses on the data, like - selecting certain clusters on the 
     ordered-density plot of a particular feature space and visualize those clusters in other plots, i.e, all the plots are linked.
+
+    The clustering can also be run without a display: compute() loads the data, runs AstroLink and builds the master table
+    without importing Glueviz, and returns an AstroGlueResults object that can be saved to disk and later passed to
+    visualize().
     
     Parameters
     ---------
@@ -45,6 +57,8 @@ class AstroGlue:
 
     data_df : 'pandas dataframe'
             The data from the input .NPY or .CSV file converted to a pandas dataframe object with the column names specified.
+            If None is passed to set_variables(), it is loaded from file_path, in which case a .NPY file is memory-mapped
+            and a .CSV file is read through a binary sidecar that is written next to it on the first load.
 
     type_l : 'list'
             A list of the names of the type of plot that can be used in GlueViz. Currently the following plot types are supported:
@@ -91,6 +105,74 @@ class AstroGlue:
 
     verbose_list : 'list'
             A list containing the verbosity parameter setting for feature space corresponding to 'feature_space_name'.
+
+    n_jobs : 'int'
+            The number of feature spaces clustered at the same time on a process pool, set using set_parallel(). The
+            default of 1 runs AstroLink on one feature space after another in the current process.
+
+    n_cores : 'int'
+            The total number of cores shared between the concurrent AstroLink jobs, set using set_parallel(). If -1, all
+            the cores of the machine are used.
+
+    cache : 'ResultCache'
+            An on-disk cache of AstroLink results, set using set_cache(). Feature spaces whose columns and parameters were
+            clustered before are loaded from it instead of being clustered again.
+
+    tracer : 'Tracer'
+            Records the wall time, CPU time and peak RSS of every stage, set using set_instrumentation().
+
+    lod_max_points : 'int'
+            The point budget of the 3D scatter viewers, set using set_level_of_detail(). If the data has more points, the
+            3D viewers show a subsample stratified by AstroLink cluster instead. If None, they show every point.
+
+    density_map_rows : 'int'
+            The number of rows above which the 2D scatter plots draw the data as a density map rather than as markers,
+            set using set_density_maps(). Subsets are always drawn as markers. If None, markers are always used.
+
+    compact : 'bool'
+            Whether numeric data is stored as float32 and the ordered_index_* and input order columns as int32, set
+            using set_precision(). This roughly halves the memory of a session. AstroLink still runs on a float64 copy
+            of each feature space. Integer columns with values beyond 2**24, which float32 cannot store exactly, raise a ValueError.
+
+    project : 'bool'
+            Whether only the columns of a .csv file that the feature spaces and plots use are read, set using
+            set_projection().
+
+    file_columns : 'list'
+            All the column names of the .csv file when data_df only holds some of them because of set_projection(),
+            otherwise None. The others are read by load_columns() when they are first needed. Columns renamed in
+            the input window are listed under their new names.
+
+    renamed_columns : 'dict'
+            The columns of a .csv file renamed in the input window before it was read because of set_projection(),
+            mapping their new names to their names in the file.
+
+    changed_spaces : 'list'
+            The names of the feature spaces that the last run of AstroLink clustered, or took from the cache, because
+            they were new or their columns, data or parameters had changed. The other feature spaces kept their results
+            from the previous run, so after set_variables() has added, removed or edited feature spaces, rerun() only
+            clusters the changed ones and updates the running Glue application in place.
+
+    cancel_event : 'threading.Event'
+            If set, setting it from another thread cancels compute(), which then raises RunCancelled before its next
+            stage. AstroLink jobs running on the process pool of set_parallel() are terminated straight away.
+
+    progress : 'callable'
+            If set, called with the name of every stage of compute() as it starts, e.g. 'load', 'AstroLink pool' or
+            'data_prep', and with 'AstroLink <name>' as the clustering of each feature space starts, or finishes when
+            it runs on a process pool. It may be called from another thread.
+
+    space_done : 'callable'
+            If set, called with the position of every feature space in feature_space_name and its AstroLink result as
+            soon as that result is ready. It may be called from another thread.
+
+    linked : 'bool'
+            Whether the columns of every feature space are kept in their own Glue dataset joined to 'dataframe' on the
+            input order, rather than added to 'dataframe' itself, set using set_linked_datasets().
+
+    preview_spaces : 'set'
+            The names of the feature spaces whose ordered-density viewers show the AstroLink result of a subsample
+            (see visualize_streaming()) rather than that of the whole dataset.
     """
     def __init__(self):
         self.file_path = None
@@ -107,6 +189,24 @@ class AstroGlue:
         self.var_plot_list = None
         self.type_l = None
         self.groups_l = None
+        self.n_jobs = 1
+        self.n_cores = -1
+        self.cache = None
+        self.tracer = None
+        self.lod_max_points = None
+        self.lod_min_cluster_points = 10
+        self.density_map_rows = 10**5
+        self.density_map_bins = 1024
+        self.compact = False
+        self.project = False
+        self.file_columns = None
+        self.renamed_columns = {}
+        self.linked = False
+        self.space_results = {}
+        self.changed_spaces = []
+        self.cancel_event = None
+        self.progress = None
+        self.space_done = None
 
         self.P = None
         self.astrolink_list = []
@@ -116,12 +216,33 @@ class AstroGlue:
         self.col_l = [f"C{i}" for i in range(10) if i != 3]
         self.ord_ind_l = []
         self.log_rho_l = []
+        self.ordered_density_renderers = []
+        self.level_of_detail = None
+        self.density_map_renderers = []
+        self.ordered_density_viewers = {}
+        self.preview_spaces = set()
+        self.stream_queue = None
+        self.stream_timer = None
+        self.hierarchies = {}
 
     #Function to accept variables directly without using the tkinter GUI
     def set_variables(self, file_path, data_df, feature_spaces, adaptive_list, k_den_list, S_list, k_link_list, h_style_list, workers_list, verbose_list, feature_space_name, var_plot_list, type_l):
         """This method of the AstroGlue can be used to set values to the variables used without having to input through the GUI.
         """
         self.file_path = file_path.replace("\\", "\\\\")
+        if data_df is None and self.project and not self.file_path.endswith('.npy'):
+            # Read by compute(), once the columns it needs are known
+            self.P = None
+            self.file_columns = None
+            self.renamed_columns = {}
+        elif data_df is None:
+            self.P, data_df = load_file(self.file_path)
+            self.file_columns = None
+            self.renamed_columns = {}
+        elif data_df is not self.data_df:
+            self.P = None
+            self.file_columns = None
+            self.renamed_columns = {}
         self.data_df = data_df
         self.feature_spaces = feature_spaces
         self.adaptive_list = adaptive_list
@@ -135,162 +256,1017 @@ class AstroGlue:
         self.var_plot_list = var_plot_list
         self.type_l = type_l
 
+    def set_parallel(self, n_jobs=-1, n_cores=-1):
+        """Runs the AstroLink jobs of the feature spaces concurrently on a process pool of n_jobs processes (-1 for one
+        per feature space) sharing n_cores cores (-1 for all of them). Feature spaces with workers set to -1 are given
+        their share of the cores."""
+        self.n_jobs = n_jobs
+        self.n_cores = n_cores
+
+    def set_cache(self, cache_dir=None, max_bytes=4 * 2**30):
+        """Stores AstroLink results in cache_dir (see ResultCache) and reuses them whenever the same columns are
+        clustered again with the same parameters. The least recently used results are evicted beyond max_bytes."""
+        self.cache = ResultCache(cache_dir, max_bytes)
+
+    def set_instrumentation(self, callback=None, trace_path=None):
+        """Records a span (see Tracer) around loading, each AstroLink run, data_prep, the DataCollection construction and
+        each viewer. Every finished span is passed to callback and, if trace_path is given, all spans so far are written
+        to it as a Chrome trace. The spans are also kept in self.tracer.spans."""
+        self.tracer = Tracer(callback, trace_path)
+
+    def set_level_of_detail(self, max_points=10**6, min_cluster_points=10):
+        """Makes the 3D scatter viewers show at most max_points points (see stratified_subsample), with at least
+        min_cluster_points points of every AstroLink cluster. The subsample is a separate Glue dataset joined to the full
+        one, so selections carry over between them, and subsets of at most max_points points are drawn in full."""
+        self.lod_max_points = max_points
+        self.lod_min_cluster_points = min_cluster_points
+
+    def set_density_maps(self, min_rows=10**5, bins=1024):
+        """Makes the 2D scatter plots of data with more than min_rows rows draw it as a density map (see
+        DensityMapRenderer) built from a bins x bins histogram, while subsets are still drawn as markers. If min_rows is
+        None, markers are always drawn."""
+        self.density_map_rows = min_rows
+        self.density_map_bins = bins
+
+    def set_precision(self, compact=True):
+        """Stores numeric data as float32, and the ordered_index_* and input order columns as int32 when there are
+        fewer than 2**31 points, if compact is True. Otherwise float64 and int64 are used. Loading data with integer
+        columns that float32 cannot store exactly, such as large IDs, then raises a ValueError (see check_float32())."""
+        self.compact = compact
+
+    def set_linked_datasets(self, linked=True):
+        """Keeps the ordered_index_*/log_rho_* columns of every feature space in a small Glue dataset of its own,
+        'feature space <name>', if linked is True, instead of adding them to 'dataframe'. Each of these datasets is
+        joined to 'dataframe' on the input order, so selections made in the ordered-density plots still carry over to
+        the other viewers and back, while 'dataframe' only holds the data columns however many feature spaces there
+        are. The data columns are not copied in either case."""
+        self.linked = linked
+
+    def set_projection(self, project=True):
+        """Makes compute() read only the columns of a .csv file that the feature spaces and plots use, if project is
+        True, with explicit dtypes (float32 if set_precision() was used) and with the multi-threaded pyarrow parser if
+        it is installed. The other columns are read by load_columns() when a later viewer or summary asks for them.
+        set_variables() then leaves the file unread, so call this before it."""
+        self.project = project
+
+    def span(self, name, check_cancel=True, **args):
+        """Returns a context manager recording its block as a span called name, or doing nothing if
+        set_instrumentation() was not used. Every stage starts with a span, so this is also where progress is reported
+        and, unless check_cancel is False, cancellation is checked. Spans opened on the Qt thread do not check it, as
+        only the background run is cancelled."""
+        if check_cancel and self.cancel_event is not None and self.cancel_event.is_set():
+            raise RunCancelled()
+        if self.progress is not None:
+            self.progress(name)
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(name, **args)
+
     def get_index(self, fi):
         return [self.data_df.columns.get_loc(col) for col in fi]
     
-    def data_prep(self):
-        indi_l = []
-        for i in range(0, len(self.data_df.columns)):
-            indi_l.append(list(self.P[:, i]))
-        transposed_indi_l = list(zip(*indi_l))
-        master_list = []
-        for i in range(len(self.astrolink_list)):
-            l1 = list(range(self.astrolink_list[i].n_samples))
-            l2 = list(self.astrolink_list[i].logRho[self.astrolink_list[i].ordering])
-            df1 = pd.DataFrame(list(zip(l1, l2)), columns=[self.ord_ind_l[i], self.log_rho_l[i]])
-
-            df2 = pd.DataFrame(transposed_indi_l, columns=self.data_df.columns)
-            df2[self.ord_ind_l[i]] = self.astrolink_list[i].ordering.argsort()
-
-            try:
-                merged_df1.drop()
-            except:
-                pass
-            merged_df1 = pd.merge(df2, df1, on=self.ord_ind_l[i], sort=False)
-            merged_df1["input order"] = merged_df1.index
+    def load_data(self):
+        """Returns the input data as a 2D array. A .npy file is memory-mapped rather than read into memory. A .csv file
+        is copied from data_df into a column-major array, and data_df is replaced by a dataframe of views of its
+        columns, so that only one copy of the data is kept."""
+        if self.file_path.endswith('.npy'):
+            return load_npy(self.file_path)
+        if self.data_df is None:
+            # set_projection() was used
+            names = {col: new for new, col in self.renamed_columns.items()}
+            self.file_columns = [names.get(col, col) for col in read_header(self.file_path)]
+            self.data_df = self.read_file_columns(self.used_columns())
+        P = column_major(self.data_df, self.compact_dtype(self.data_df))
+        # With text columns P is an object array, and data_df keeps the dtype of every column
+        if self.is_numeric([P.dtype]):
+            self.data_df = array_to_df(P, self.data_df.columns)
+        return P
+
+    def used_columns(self):
+        """Returns the columns of the input file that the feature spaces and plots use, in the order they are first
+        used."""
+        cols = [col for fs in self.feature_spaces for col in fs] + [col for cols in self.var_plot_list for col in cols]
+        return [col for col in dict.fromkeys(cols) if self.file_columns is None or col in self.file_columns]
+
+    def read_file_columns(self, columns):
+        """Reads columns of the .csv file, given by their names in data_df, which differ from those in the file for
+        the columns in renamed_columns."""
+        data_df = load_csv_columns(self.file_path, [self.renamed_columns.get(col, col) for col in columns],
+                                   self.compact)
+        data_df.columns = columns
+        return data_df
+
+    def load_columns(self, columns):
+        """Reads the columns of the .csv file that set_projection() left out and that are in columns, and adds them to
+        data_df and self.P, to the master table and to the Glue data if Glueviz is running. Columns that are already
+        loaded or are not in the file, such as the ordered_index_* columns, are skipped."""
+        if self.file_columns is None:
+            return
+        missing = [col for col in dict.fromkeys(columns) if col in self.file_columns and col not in self.data_df.columns]
+        if not missing:
+            return
+        with self.span("load columns", columns=missing):
+            new = self.read_file_columns(missing)
+        # The new columns go after the loaded ones, so the indices of the feature spaces stay the same and their
+        # results are still recognised by run_astrolink()
+        data_df = pd.concat([self.data_df, new], axis=1)
+        self.P = column_major(data_df, self.compact_dtype(data_df))
+        self.data_df = array_to_df(self.P, data_df.columns) if self.is_numeric([self.P.dtype]) else data_df
+        if self.master_df is None:
+            return
+        columns = {col: self.P[:, j] for j, col in enumerate(self.data_df.columns)}
+        columns.update((col, self.master_df[col].to_numpy()) for col in self.master_df.columns if col not in columns)
+        self.master_df = pd.DataFrame(columns, copy=False)
+        if self.dc is not None:
+            for col in missing:
+                values = self.master_df[col].to_numpy()
+                self.dc['dataframe'].add_component(self.glue_component(values), col)
+                if self.level_of_detail is not None:
+                    self.level_of_detail.lod.add_component(self.glue_component(values[self.level_of_detail.indices]),
+                                                           col)
+
+    @staticmethod
+    def is_numeric(dtypes):
+        """Returns whether all of dtypes are boolean, integer or floating point numpy dtypes."""
+        return all(getattr(t, "kind", "O") in "biuf" for t in dtypes)
+
+    def compact_dtype(self, data_df):
+        """Returns the dtype the columns of data_df are stored as: float32 if set_precision() was used and they are all
+        numeric, after check_float32(), and otherwise None for their common dtype."""
+        if not (self.compact and self.is_numeric(data_df.dtypes)):
+            return None
+        check_float32(data_df)
+        return np.float32
+
+    def compact_data(self):
+        """Replaces self.P by a column-major float32 copy, and data_df by a dataframe of views of its columns."""
+        check_float32(self.data_df)
+        self.P = column_major(self.P, np.float32)
+        self.data_df = array_to_df(self.P, self.data_df.columns)
+
+    def index_dtype(self, n):
+        """Returns the dtype of the ordered_index_* and input order columns of n points."""
+        return np.int32 if self.compact and n < 2**31 else np.int64
 
-            master_list.append(merged_df1)
-        master_df = master_list[0]
-        for i in range(1, len(master_list)):
-            master_list[i] = master_list[i][["input order", self.ord_ind_l[i], self.log_rho_l[i]]]
-            master_df = pd.merge(master_df, master_list[i], on='input order', how='inner')
-        return master_df
+    def data_prep(self):
+        """Builds the master table holding the raw columns and, for every feature space, the position of each point in
+        the AstroLink ordered list and its log-density.
+
+        The raw columns are taken once from self.P and each feature space only adds its two columns. The position of
+        each point in the ordered list is ordering.argsort(), and gathering logRho[ordering] at that position gives back
+        logRho itself, so the rows stay in input order without any merging. The columns are not copied, so the raw
+        columns of the master table are views of self.P, or the columns of data_df if the data has text columns, and
+        the columns of feature spaces that are not in changed_spaces are taken over from the previous master table."""
+        previous = self.master_df if self.master_df is not None else pd.DataFrame()
+        if self.is_numeric([self.P.dtype]):
+            columns = {col: self.P[:, j] for j, col in enumerate(self.data_df.columns)}
+        else:
+            # Each column keeps its own dtype rather than that of the object array P
+            columns = {col: self.data_df[col] for col in self.data_df.columns}
+        for i, c in enumerate(self.astrolink_list):
+            reuse = [self.ord_ind_l[i], self.log_rho_l[i]] + (["input order"] if i == 0 else [])
+            if self.feature_space_name[i] not in self.changed_spaces and all(col in previous.columns for col in reuse):
+                for col in reuse:
+                    columns[col] = previous[col].to_numpy()
+                continue
+            columns[self.ord_ind_l[i]], columns[self.log_rho_l[i]] = self.space_columns(c)
+            if i == 0:
+                columns["input order"] = np.arange(c.n_samples, dtype=self.index_dtype(c.n_samples))
+        return pd.DataFrame(columns, copy=False)
+
+    def space_columns(self, c):
+        """Returns the ordered_index_* and log_rho_* columns of the AstroLink result c."""
+        index_dtype = self.index_dtype(c.n_samples)
+        # The inverse permutation of the ordering, i.e. ordering.argsort(), in linear time
+        ordered_index = np.empty(c.n_samples, dtype=index_dtype)
+        ordered_index[c.ordering] = np.arange(c.n_samples, dtype=index_dtype)
+        return ordered_index, c.logRho.astype(np.float32, copy=False) if self.compact else c.logRho
+
+    def get_astrolink_params(self, i):
+        """Returns the AstroLink keyword arguments of the i-th feature space."""
+        return dict(adaptive=self.adaptive_list[i], k_den=self.k_den_list[i], S=self.S_list[i],
+                    k_link=self.k_link_list[i], h_style=self.h_style_list[i], workers=self.workers_list[i],
+                    verbose=self.verbose_list[i])
+
+    def run_astrolink(self):
+        """Runs AstroLink on every feature space and appends the results to astrolink_list, in the same order as
+        feature_space_name. Feature spaces whose columns, data and parameters are the same as in the previous run keep
+        their results, the others are looked up in the cache set by set_cache() and only then clustered, on a process
+        pool if set_parallel() was used. The names of the feature spaces that did not keep their results are stored in
+        changed_spaces."""
+        indices = [self.get_index(fs) for fs in self.feature_spaces]
+        params_list = [self.get_astrolink_params(i) for i in range(len(self.feature_spaces))]
+        results = [None] * len(indices)
+        keys = [None] * len(indices)
+        self.changed_spaces = []
+        for i, (ind, params) in enumerate(zip(indices, params_list)):
+            name = self.feature_space_name[i]
+            with self.span("key " + name):
+                keys[i] = ResultCache.key(self.P, ind, params)
+            previous = self.space_results.get(name)
+            if previous is not None and previous[0] == keys[i]:
+                results[i] = previous[1]
+            else:
+                self.changed_spaces.append(name)
+                if self.cache is not None:
+                    with self.span("cache lookup " + name):
+                        results[i] = self.cache.get(keys[i])
+            if results[i] is not None and self.space_done is not None:
+                self.space_done(i, results[i])
+        todo = [i for i in range(len(indices)) if results[i] is None]
+        if len(todo) == 0:
+            self.space_results = {name: (keys[i], results[i]) for i, name in enumerate(self.feature_space_name)}
+            self.astrolink_list.extend(results)
+            return
+        if self.n_jobs != 1 and len(todo) > 1:
+            with self.span("AstroLink pool", feature_spaces=[self.feature_space_name[i] for i in todo]):
+                def on_done(j, c):
+                    if self.progress is not None:
+                        self.progress("AstroLink " + self.feature_space_name[todo[j]])
+                    if self.space_done is not None:
+                        self.space_done(todo[j], c)
+                done = run_astrolink_pool(self.P, [indices[i] for i in todo], [params_list[i] for i in todo], self.n_jobs,
+                                          self.n_cores, self.cancel_event, on_done)
+        else:
+            from astrolink import AstroLink
+            done = []
+            for i in todo:
+                with self.span("AstroLink " + self.feature_space_name[i], n_samples=self.P.shape[0]):
+                    c = AstroLink(astrolink_input(column_slice(self.P, indices[i])), **params_list[i])
+                    c.run()
+                if self.space_done is not None:
+                    self.space_done(i, c)
+                done.append(c)
+        for i, c in zip(todo, done):
+            if self.cache is not None:
+                self.cache.put(keys[i], c)
+            results[i] = c
+        self.space_results = {name: (keys[i], results[i]) for i, name in enumerate(self.feature_space_name)}
+        self.astrolink_list.extend(results)
+
+    def sweep(self, name, **grid):
+        """Runs AstroLink on the feature space called name with every combination of the parameter values in grid, e.g.
+        sweep("pos", S=[2, 3, 'auto'], k_link=[5, 10, 'auto']), the other parameters being those of the feature space.
+        The neighbour search and density estimate are run once per distinct adaptive and k_den, and the later stages
+        are spread over a process pool if set_parallel() was used (see sweep_astrolink()). Returns the comparison
+        table, with one row per setting, and the AstroLinkResult of every setting."""
+        i = self.feature_space_name.index(name)
+        self.load_input()
+        settings = expand_grid(self.get_astrolink_params(i), grid)
+        with self.span("sweep " + name, n_settings=len(settings)):
+            return sweep_astrolink(astrolink_input(column_slice(self.P, self.get_index(self.feature_spaces[i]))),
+                                   settings, self.n_jobs, self.n_cores)
+
+    def preview(self, ind, on_done=None):
+        """Runs AstroLink on the points ind of every feature space, e.g. a stratified_subsample() small enough to be
+        clustered in a few seconds, and returns the results in the same order as feature_space_name. on_done, if given,
+        is called with the position of every feature space and its result as soon as that result is ready."""
+        from astrolink import AstroLink
+
+        self.load_input()
+        results = []
+        for i, fs in enumerate(self.feature_spaces):
+            with self.span("preview " + self.feature_space_name[i], n_samples=len(ind)):
+                # Only the rows of the subsample are read from self.P
+                c = AstroLink(astrolink_input(self.P[np.ix_(ind, self.get_index(fs))]), **self.get_astrolink_params(i))
+                c.run()
+            if on_done is not None:
+                on_done(i, c)
+            results.append(c)
+        return results
+
+    def cluster_summary(self, name, columns=None, weights=None):
+        """Returns a dataframe with the count, mean, standard deviation and median of every column in columns (all
+        numeric data columns by default) for every cluster of the feature space called name, one row per cluster (see
+        summary.cluster_summary()). If weights names a column, the total mass and the mass-weighted centroids of the
+        clusters are added."""
+        i = self.feature_space_name.index(name)
+        self.load_columns(list(columns or []) + ([weights] if weights is not None else []))
+        if columns is None:
+            columns = [col for col in self.data_df.columns if self.is_numeric([self.data_df[col].dtype])]
+        values = {col: self.P[:, self.data_df.columns.get_loc(col)] for col in columns}
+        if weights is not None:
+            weights = self.P[:, self.data_df.columns.get_loc(weights)]
+        with self.span("cluster summary " + name, n_clusters=len(self.astrolink_list[i].clusters)):
+            return cluster_summary(self.astrolink_list[i], values, weights)
+
+    def add_cluster_summary(self, name, columns=None, weights=None):
+        """Adds the cluster_summary() of the feature space called name to the Glue data collection as its own dataset,
+        'clusters <name>', or updates that dataset if it is already there. Returns the summary dataframe."""
+        summary = self.cluster_summary(name, columns, weights)
+        label = "clusters " + name
+        existing = [data for data in self.dc if data.label == label]
+        if existing:
+            self.update_glue_data(existing[0], summary)
+        else:
+            self.dc.append(self.make_glue_data(summary, label))
+        return summary
+
+    def cluster_hierarchy(self, name):
+        """Returns the ClusterHierarchy of the feature space called name, which is built once per AstroLink result."""
+        c = self.astrolink_list[self.feature_space_name.index(name)]
+        hierarchy = self.hierarchies.get(name)
+        if hierarchy is None or hierarchy.source is not c:
+            with self.span("cluster hierarchy " + name):
+                hierarchy = self.hierarchies[name] = ClusterHierarchy(c)
+        return hierarchy
+
+    def add_cluster_labels(self, name):
+        """Adds the int32 column 'cluster_<name>', the position in the cluster ids of the deepest cluster of every point
+        of the feature space called name, to the master table and to the Glue data if Glueviz is running. Returns the
+        labels."""
+        labels = self.cluster_hierarchy(name).labels()
+        label = "cluster_" + name
+        self.master_df[label] = labels
+        if self.dc is not None:
+            self.dc['dataframe'].add_component(labels, label)
+            if self.level_of_detail is not None:
+                self.level_of_detail.lod.add_component(labels[self.level_of_detail.indices], label)
+        return labels
+
+    def add_cluster_subsets(self, name, clusters=None):
+        """Creates a Glue subset for each of clusters (id strings such as '1-2', all clusters but the root by default)
+        of the feature space called name. Each subset selects the range of its cluster on the ordered_index_<name>
+        column, so no geometric selection is needed. Returns the subset groups."""
+        from glue.core.subset import RangeSubsetState
+
+        hierarchy = self.cluster_hierarchy(name)
+        if clusters is None:
+            clusters = hierarchy.ids[1:]
+        i = self.feature_space_name.index(name)
+        att = self.space_data(i).id[self.ord_ind_l[i]]
+        groups = []
+        for cluster in clusters:
+            s, e = hierarchy.range(cluster)
+            groups.append(self.dc.new_subset_group(name + " " + hierarchy.ids[hierarchy.find(cluster)],
+                                                   RangeSubsetState(s, e - 1, att)))
+        return groups
+
+    def make_glue_data(self, df, label):
+        """Returns a Glue Data object called label whose components are built directly from the numpy arrays behind
+        the columns of df, rather than through Glue's DataFrame translator, so that numeric columns are shared with df
+        instead of being copied. Every column is typed on its own: numbers held in an object column are numeric
+        components, and only text columns are categorical."""
+        from glue.core import Data
+
+        data = Data(label=label)
+        for col in df.columns:
+            data.add_component(self.glue_component(df[col].to_numpy()), str(col))
+        return data
+
+    @staticmethod
+    def glue_component(values):
+        """Returns the Glue component of the column values. Component.autotyped() makes any object array categorical,
+        so an object column holding only numbers is converted to float64 first."""
+        from glue.core.component import Component
+
+        if values.dtype.kind == "O" and pd.api.types.infer_dtype(values, skipna=True) in ("integer", "floating",
+                                                                                          "mixed-integer-float"):
+            values = values.astype(np.float64)
+        if values.dtype.kind in "biuf":
+            return Component(values)
+        return Component.autotyped(values)
+
+    def raw_table(self):
+        """Returns the columns of the master table that go into the 'dataframe' Glue dataset: all of them, or with
+        set_linked_datasets() all but the ordered_index_*/log_rho_* columns. The columns are not copied."""
+        if not self.linked:
+            return self.master_df
+        space_columns = set(self.ord_ind_l) | set(self.log_rho_l)
+        return pd.DataFrame({col: self.master_df[col].to_numpy() for col in self.master_df.columns
+                             if col not in space_columns}, copy=False)
+
+    @staticmethod
+    def space_label(name):
+        """Returns the label of the Glue dataset of the feature space called name (see set_linked_datasets())."""
+        return "feature space " + name
+
+    def space_data(self, i):
+        """Returns the Glue dataset holding the ordered_index_*/log_rho_* columns of the i-th feature space."""
+        if self.linked:
+            return self.dc[self.space_label(self.feature_space_name[i])]
+        return self.dc['dataframe']
+
+    def set_space_data(self, i, columns):
+        """Sets the ordered_index_*/log_rho_* columns of the i-th feature space in its Glue dataset to columns, adding
+        them, or with set_linked_datasets() the dataset itself, if they are not there yet."""
+        from glue.core import Data
+        from glue.core.component import Component
+
+        labels = (self.ord_ind_l[i], self.log_rho_l[i])
+        if self.linked and self.space_label(self.feature_space_name[i]) not in self.dc.labels:
+            full = self.dc['dataframe']
+            if full.find_component_id("input order") is None:
+                full.add_component(np.arange(full.size, dtype=self.index_dtype(full.size)), "input order")
+            # The input order array is shared with 'dataframe' rather than copied
+            data = Data(label=self.space_label(self.feature_space_name[i]))
+            data.add_component(Component.autotyped(full.get_component("input order").data), "input order")
+            for label, values in zip(labels, columns):
+                data.add_component(Component.autotyped(values), label)
+            self.dc.append(data)
+            self.join_to_dataframe(data)
+            return
+        data = self.space_data(i)
+        cids = {cid.label: cid for cid in data.main_components}
+        updates = {}
+        for label, values in zip(labels, columns):
+            if label in cids:
+                updates[cids[label]] = values
+            else:
+                data.add_component(Component.autotyped(values), label)
+        if updates:
+            data.update_components(updates)
+
+    def update_glue_datasets(self):
+        """Brings the Glue datasets in line with the master table with update_glue_data(): 'dataframe', the decimated
+        dataset and, with set_linked_datasets(), the dataset of every feature space, adding those of new feature spaces
+        and removing those of feature spaces that are gone."""
+        raw = self.raw_table()
+        self.update_glue_data(self.dc['dataframe'], raw)
+        if self.level_of_detail is not None:
+            self.update_level_of_detail()
+        if not self.linked:
+            return
+        for i in range(len(self.feature_space_name)):
+            self.set_space_data(i, [self.master_df[col].to_numpy() for col in (self.ord_ind_l[i], self.log_rho_l[i])])
+        labels = {self.space_label(name) for name in self.feature_space_name}
+        for data in list(self.dc):
+            if data.label.startswith("feature space ") and data.label not in labels:
+                self.remove_joined_data(data)
+
+    def join_to_dataframe(self, data):
+        """Joins the Glue dataset data to 'dataframe' on the input order, both ways, so that subsets carry over between
+        them. The join is a JoinLink of the data collection, which remove_joined_data() takes down again."""
+        from glue.core.link_helpers import JoinLink
+
+        full = self.dc['dataframe']
+        self.dc.add_link(JoinLink(cids1=[full.id["input order"]], cids2=[data.id["input order"]], data1=full,
+                                  data2=data))
+
+    def remove_joined_data(self, data):
+        """Removes the Glue dataset data from the data collection, with its join to 'dataframe' and its other links."""
+        for link in self.dc.external_links:
+            if getattr(link, "data1", None) is data or getattr(link, "data2", None) is data:
+                self.dc.remove_link(link)
+        self.dc.remove(data)
 
     def make_ordered_density_plots(self, ax, c):
-        """Makes the ordered density plots for the various feature spaces."""
-        logRho_ordered = c.logRho[c.ordering]
-        ax.plot(range(c.n_samples), logRho_ordered, 'k-', lw=0.1, zorder=2)
-        ax.fill_between(range(c.n_samples), logRho_ordered, 0, color='k', label=c.ids[0], zorder=1)
-        rootClstBool = np.ones(c.n_samples, dtype=np.bool_)
-        for i, (clst, clst_id) in enumerate(zip(c.clusters, c.ids)):
-            if i > 0:
-                rootClstBool[clst[0]:clst[1]] = 0
-                ord_dens_clst = logRho_ordered[clst[0]:clst[1]]
-                colo = (i - 1) % 9
-                ax.fill_between(range(clst[0], clst[1]), ord_dens_clst, ord_dens_clst.min(), color=self.col_l[colo], label=clst_id, zorder=1)
+        """Makes the ordered density plots for the various feature spaces. The plot is drawn at screen resolution by an
+        OrderedDensityRenderer, which follows the zoom of the viewer and is kept in ordered_density_renderers."""
+        colors = [self.col_l[(i - 1) % 9] for i in range(1, len(c.clusters))]
+        renderer = OrderedDensityRenderer(ax, c.logRho[c.ordering], c.clusters, colors)
+        renderer.update()
+        self.ordered_density_renderers.append(renderer)
         ax.figure.canvas.draw()
+        return renderer
+
+    def plot_ordered_density(self, i, c=None):
+        """To plot the Ordered-Density Plot of the i-th feature space, whose AstroLink result is c or else
+        astrolink_list[i]. The viewer and its renderer are kept in ordered_density_viewers under the name of the
+        feature space."""
+        from glue_qt.viewers.scatter import ScatterViewer
+        data = self.space_data(i)
+        scatter1 = self.ga.new_data_viewer(ScatterViewer)
+        scatter1.add_data(data)
+        scatter1.state.x_att = data.id[self.ord_ind_l[i]]
+        scatter1.state.y_att = data.id[self.log_rho_l[i]]
+        ax = scatter1.axes
+        ax.set_title(self.ordered_density_title(i))
+        renderer = self.make_ordered_density_plots(ax, self.astrolink_list[i] if c is None else c)
+        self.ordered_density_viewers[self.feature_space_name[i]] = (scatter1, renderer)
+
+    def ordered_density_title(self, i, n_preview=None):
+        """Returns the title of the Ordered-Density Plot of the i-th feature space, or of its preview on a subsample of
+        n_preview points."""
+        title = "Ordered-Density Plot for " + self.feature_space_name[i] + " Space (coloured by cluster ID)"
+        if n_preview is not None:
+            title += f"\npreview on a subsample of {n_preview:,} points"
+        return title
+
+    def replace_ordered_density(self, i, c):
+        """Redraws the ordered-density viewer of the i-th feature space with the AstroLink result c. A viewer that
+        showed a preview is zoomed out to the whole of c."""
+        name = self.feature_space_name[i]
+        viewer, renderer = self.ordered_density_viewers[name]
+        renderer.remove()
+        self.ordered_density_renderers.remove(renderer)
+        self.ordered_density_viewers[name] = (viewer, self.make_ordered_density_plots(viewer.axes, c))
+        if name in self.preview_spaces:
+            self.preview_spaces.discard(name)
+            viewer.axes.set_title(self.ordered_density_title(i))
+            viewer.state.reset_limits()
+
+    def make_density_map(self, scatter, x, y):
+        """Draws the data of a 2D scatter viewer as a density map instead of markers if it has more than
+        density_map_rows rows. The markers of the data are hidden, and those of its subsets stay visible."""
+        if self.density_map_rows is None or len(self.master_df) <= self.density_map_rows:
+            return
+        from glue.core.subset import Subset
+
+        data = self.dc['dataframe']
+        for layer in scatter.layers:
+            if layer.layer is data:
+                layer.state.visible = False
+
+        # Glue switches large layers to its own density map, which it does not support on full-sphere projections
+        def subsets_as_markers(*args):
+            for layer_state in scatter.state.layers:
+                if isinstance(layer_state.layer, Subset) and layer_state.points_mode != 'markers':
+                    layer_state.points_mode = 'markers'
+
+        scatter.state.add_callback('layers', subsets_as_markers)
+        subsets_as_markers()
+        self.density_map_renderers.append((scatter, x, y, self.draw_density_map(scatter, x, y)))
+
+    def draw_density_map(self, scatter, x, y):
+        """Draws the columns x and y of the master table onto the axes of a 2D scatter viewer with a
+        DensityMapRenderer, and returns it."""
+        x, y = self.master_df[x].to_numpy(), self.master_df[y].to_numpy()
+        full_sphere = scatter.state.using_full_sphere
+        if full_sphere:
+            # The same wrapping to [-pi, pi] as the markers of the full-sphere projections
+            if scatter.state.using_degrees:
+                x, y = np.radians(x), np.radians(y)
+            x = np.mod(x + np.pi, 2 * np.pi) - np.pi
+        renderer = DensityMapRenderer(scatter.axes, x, y, self.density_map_bins, full_sphere)
+        renderer.update()
+        return renderer
 
     def plot_2d_scatter_rectilinear(self, x, y):
         """To plot 2D Rectilinear Scatter Plot"""
+        self.load_columns([x, y])
+        from glue_qt.viewers.scatter import ScatterViewer
         scatter = self.ga.new_data_viewer(ScatterViewer)
         scatter.add_data(self.dc['dataframe'])
         scatter.state.x_att = self.dc['dataframe'].id[x]
         scatter.state.y_att = self.dc['dataframe'].id[y]
         scatter.state.size = 5
+        self.make_density_map(scatter, x, y)
 
     def plot_2d_scatter_aitoff(self, x, y):
         """To plot 2D Aitoff Scatter Plot"""
+        self.load_columns([x, y])
+        from glue_qt.viewers.scatter import ScatterViewer
         scatter = self.ga.new_data_viewer(ScatterViewer)
         scatter.add_data(self.dc['dataframe'])
         scatter.state.x_att = self.dc['dataframe'].id[x]
         scatter.state.y_att = self.dc['dataframe'].id[y]
         scatter.state.size = 5
         scatter.state.plot_mode = "aitoff"
+        self.make_density_map(scatter, x, y)
+
+    def level_of_detail_indices(self):
+        """Returns the rows of the subsample shown by the 3D scatter viewers, stratified by the current clusters."""
+        return stratified_subsample(len(self.master_df), self.lod_max_points, self.astrolink_list,
+                                    self.lod_min_cluster_points)
+
+    def level_of_detail_table(self, ind):
+        """Returns the rows ind of the columns of 'dataframe', with their input order."""
+        lod_df = self.raw_table().iloc[ind]
+        if "input order" not in lod_df.columns:
+            lod_df = lod_df.assign(**{"input order": ind.astype(self.index_dtype(len(self.master_df)))})
+        return lod_df
+
+    def make_level_of_detail(self, ind=None):
+        """Adds the subsample shown by the 3D scatter viewers, the rows ind or by default those of
+        level_of_detail_indices(), to the data collection as 'dataframe (decimated)', joined to 'dataframe' on the
+        input order, and sets up the LevelOfDetail that switches subsets to full resolution."""
+        from glue.core.link_helpers import LinkSame
+
+        full = self.dc['dataframe']
+        if full.find_component_id("input order") is None:
+            n = len(self.master_df)
+            full.add_component(np.arange(n, dtype=self.index_dtype(n)), "input order")
+        if ind is None:
+            ind = self.level_of_detail_indices()
+        lod = self.make_glue_data(self.level_of_detail_table(ind), 'dataframe (decimated)')
+        self.dc.append(lod)
+        self.join_to_dataframe(lod)
+        # The full dataset is drawn in the same viewers, so the plotted columns must be shared
+        cols = {col for i, cols in enumerate(self.var_plot_list) if self.type_l[i] == "3D Scatter Plot" for col in cols}
+        for col in sorted(cols):
+            self.dc.add_link(LinkSame(lod.id[col], full.id[col]))
+        self.level_of_detail = LevelOfDetail(self.dc, full, lod, ind, self.lod_max_points)
+
+    def update_level_of_detail(self):
+        """Draws the subsample shown by the 3D scatter viewers again from the current results, e.g. once
+        visualize_streaming() has clustered the feature spaces, whose clusters were unknown when it was first drawn.
+        The decimated dataset is updated in place if the subsample keeps its size. Otherwise, as Glue data cannot
+        change size, a new decimated dataset replaces it in the viewers."""
+        old = self.level_of_detail
+        ind = self.level_of_detail_indices()
+        if len(ind) == len(old.indices):
+            old.indices = ind
+            self.update_glue_data(old.lod, self.level_of_detail_table(ind))
+            return
+        atts = []
+        for viewer in old.viewers:
+            atts.append([att.label for att in (viewer.state.x_att, viewer.state.y_att, viewer.state.z_att)])
+            viewer.remove_data(old.lod)
+        old.close()
+        self.remove_joined_data(old.lod)
+        self.make_level_of_detail(ind)
+        lod = self.level_of_detail.lod
+        self.level_of_detail.full_resolution = old.full_resolution
+        for viewer, (x, y, z) in zip(old.viewers, atts):
+            viewer.add_data(lod)
+            viewer.state.x_att, viewer.state.y_att, viewer.state.z_att = lod.id[x], lod.id[y], lod.id[z]
+            self.level_of_detail.add_viewer(viewer)
 
     def plot_3d_scatter(self, x, y, z):
-        """To plot 3D Scatter Plot"""
+        """To plot 3D Scatter Plot. If the level of detail is on, the decimated dataset is plotted."""
+        self.load_columns([x, y, z])
+        from glue_vispy_viewers.scatter.scatter_viewer import VispyScatterViewer
+        data = self.dc['dataframe'] if self.level_of_detail is None else self.level_of_detail.lod
         scatter = self.ga.new_data_viewer(VispyScatterViewer)
-        scatter.add_data(self.dc['dataframe'])
-        scatter.state.x_att = self.dc['dataframe'].id[x]
-        scatter.state.y_att = self.dc['dataframe'].id[y]
-        scatter.state.z_att = self.dc['dataframe'].id[z]
+        scatter.add_data(data)
+        scatter.state.x_att = data.id[x]
+        scatter.state.y_att = data.id[y]
+        scatter.state.z_att = data.id[z]
+        if self.level_of_detail is not None:
+            self.level_of_detail.add_viewer(scatter)
 
     def plot_1d_histogram(self, x):
         """To plot 1D Histogram"""
+        self.load_columns([x])
+        from glue_qt.viewers.histogram import HistogramViewer
         histo = self.ga.new_data_viewer(HistogramViewer)
         histo.add_data(self.dc["dataframe"])
         histo.state.x_att = self.dc['dataframe'].id[x]
 
-    def run(self):
-        """Runs AstroGlue. If inputs are provided usign set_variables() method, it directly opens Glueviz. If inputs are not
-        provided then it launches the tkinter GUI window prompting user to input all the required fields."""
-        if self.file_path is None or self.data_df is None or self.feature_spaces is None:
-            self.tkinter_show()
-
-        # Load the numpy file
-        if self.file_path.endswith('.npy'):
-            self.P = np.load(self.file_path)
-        elif self.file_path.endswith('.csv'):
-            self.P = self.data_df.to_numpy()
+    def load_input(self):
+        """Loads the data into self.P unless the GUI or an earlier run already did, and compacts it if
+        set_precision() was used."""
+        if self.P is None:
+            with self.span("load", file_path=self.file_path):
+                self.P = self.load_data()
+        if self.compact and self.P.dtype != np.float32 and self.is_numeric([self.P.dtype]):
+            with self.span("compact"):
+                self.compact_data()
+        # Feature spaces added since the file was read may use columns set_projection() left out
+        self.load_columns(self.used_columns())
+
+    def compute(self):
+        """Loads the data, runs AstroLink on every feature space and builds the master table without starting Glueviz,
+        so that it can be used on machines without a display. Returns an AstroGlueResults object that can be saved, or
+        passed to visualize(). Calling it again only clusters the feature spaces that have changed since."""
+        self.load_input()
 
         # Run astrolink
+        self.astrolink_list = []
+        self.changed_spaces = list(self.feature_space_name)
         if len(self.feature_spaces) != 0:
             print("Running AstroLink...")
-            for i in range(len(self.feature_spaces)):
-                ind = self.get_index(self.feature_spaces[i])
-                c = AstroLink(self.P[:, ind], adaptive=self.adaptive_list[i], k_den=self.k_den_list[i],
-                              S=self.S_list[i], k_link=self.k_link_list[i], h_style=self.h_style_list[i],
-                              workers=self.workers_list[i], verbose=self.verbose_list[i])
-                self.astrolink_list.append(c)
-                c.run()
+            self.run_astrolink()
 
+        return self.prepare_results()
+
+    def prepare_results(self):
+        """Builds the master table from the AstroLink results in astrolink_list and returns the AstroGlueResults
+        object."""
         # Organizing lists
-        for i in self.feature_space_name:
-            self.ord_ind_l.append("ordered_index_" + i)
-            self.log_rho_l.append("log_rho_" + i)
+        self.ord_ind_l = ["ordered_index_" + i for i in self.feature_space_name]
+        self.log_rho_l = ["log_rho_" + i for i in self.feature_space_name]
 
         # Prepare the data
         if len(self.astrolink_list) != 0:
             print("Preparing data")
-            self.master_df = self.data_prep()
+            with self.span("data_prep"):
+                self.master_df = self.data_prep()
         else:
             self.master_df = self.data_df
 
+        return AstroGlueResults(self.master_df, self.feature_space_name, self.astrolink_list, self.var_plot_list, self.type_l)
+
+    def visualize(self, results, start=True):
+        """Opens Glueviz with the ordered-density plots and the chosen plots of an AstroGlueResults object, whether it
+        was just returned by compute() or loaded from disk with AstroGlueResults.load(). If start is False, the Glue
+        application is set up in self.ga but not started."""
+        from glue.core import DataCollection
+        from glue_qt.app.application import GlueApplication
+
+        self.set_results(results)
+        self.ordered_density_viewers = {}
+        self.density_map_renderers = []
+
         # Start Glueviz
         print("Starting Glueviz")
-        self.dc = DataCollection()
-        self.dc['dataframe'] = self.master_df
-        self.ga = GlueApplication(self.dc)
+        with self.span("DataCollection"):
+            self.dc = DataCollection()
+            self.dc.append(self.make_glue_data(self.raw_table(), 'dataframe'))
+            if self.linked:
+                for i in range(len(self.astrolink_list)):
+                    self.set_space_data(i, [self.master_df[col].to_numpy()
+                                            for col in (self.ord_ind_l[i], self.log_rho_l[i])])
+            self.level_of_detail = None
+            if (self.lod_max_points is not None and len(self.master_df) > self.lod_max_points
+                    and "3D Scatter Plot" in self.type_l):
+                self.make_level_of_detail()
+            self.ga = GlueApplication(self.dc)
 
         # Plot ordered density plots
         for i in range(len(self.astrolink_list)):
-            scatter1 = self.ga.new_data_viewer(ScatterViewer)
-            scatter1.add_data(self.dc['dataframe'])
-            scatter1.state.x_att = self.dc['dataframe'].id[self.ord_ind_l[i]]
-            scatter1.state.y_att = self.dc['dataframe'].id[self.log_rho_l[i]]
-            viewer = self.ga.viewers[0][i]
-            ax = viewer.axes
-            ax.set_title("Ordered-Density Plot for " + self.feature_space_name[i] + " Space (coloured by cluster ID)")
-            self.make_ordered_density_plots(ax, self.astrolink_list[i])
+            with self.span("viewer Ordered-Density Plot " + self.feature_space_name[i]):
+                self.plot_ordered_density(i)
 
         # Plot other types of plots
         for i in range(len(self.var_plot_list)):
-            if self.type_l[i] == "2D Scatter Plot (rectilinear)":
-                x_ax = self.var_plot_list[i][0]
-                y_ax = self.var_plot_list[i][1]
-                self.plot_2d_scatter_rectilinear(x_ax, y_ax)
-            elif self.type_l[i] == "3D Scatter Plot":
-                x_ax = self.var_plot_list[i][0]
-                y_ax = self.var_plot_list[i][1]
-                z_ax = self.var_plot_list[i][2]
-                self.plot_3d_scatter(x_ax, y_ax, z_ax)
-            elif self.type_l[i] == "1D Histogram":
-                x_ax = self.var_plot_list[i][0]
-                self.plot_1d_histogram(x_ax)
-            elif self.type_l[i] == "2D Scatter Plot (aitoff)":
-                x_ax = self.var_plot_list[i][0]
-                y_ax = self.var_plot_list[i][1]
-                self.plot_2d_scatter_aitoff(x_ax, y_ax)
+            with self.span("viewer " + self.type_l[i], columns=self.var_plot_list[i]):
+                if self.type_l[i] == "2D Scatter Plot (rectilinear)":
+                    x_ax = self.var_plot_list[i][0]
+                    y_ax = self.var_plot_list[i][1]
+                    self.plot_2d_scatter_rectilinear(x_ax, y_ax)
+                elif self.type_l[i] == "3D Scatter Plot":
+                    x_ax = self.var_plot_list[i][0]
+                    y_ax = self.var_plot_list[i][1]
+                    z_ax = self.var_plot_list[i][2]
+                    self.plot_3d_scatter(x_ax, y_ax, z_ax)
+                elif self.type_l[i] == "1D Histogram":
+                    x_ax = self.var_plot_list[i][0]
+                    self.plot_1d_histogram(x_ax)
+                elif self.type_l[i] == "2D Scatter Plot (aitoff)":
+                    x_ax = self.var_plot_list[i][0]
+                    y_ax = self.var_plot_list[i][1]
+                    self.plot_2d_scatter_aitoff(x_ax, y_ax)
 
         # Arrange in a grid
         self.ga.gather_current_tab()
 
         # Start the application
-        self.ga.start(maximized=True)
+        if start:
+            self.ga.start(maximized=True)
+
+    def visualize_streaming(self, start=True, preview_points=None, full=True):
+        """Opens Glueviz straight away with the raw data and the chosen plots, and runs compute() on a background
+        thread. The ordered_index_*/log_rho_* columns and the ordered-density viewer of every feature space are added
+        to the running application as soon as that feature space is clustered. If start is False, the Glue
+        application is set up in self.ga but not started, and poll_stream() has to be called to add the results.
+
+        If preview_points is given, every feature space is first clustered on a random subsample of at most
+        preview_points points (see preview()), stratified by the clusters of the previous run if there was one, and
+        its ordered-density viewer shows that preview until the result of the whole dataset replaces it. If full is
+        False, only the previews are made, and the whole dataset can still be clustered later with rerun().
+        cancel_stream() stops the background run before its next stage and keeps what has been shown so far."""
+        import queue
+        import threading
+        from qtpy.QtCore import QTimer
+
+        self.load_input()
+        # The clusters of the previous run, which every preview subsample keeps some points of
+        previous = [c for c in self.astrolink_list if c.n_samples == len(self.data_df)]
+        self.visualize(AstroGlueResults(self.data_df, self.feature_space_name, [], self.var_plot_list, self.type_l),
+                       start=False)
+
+        # The feature spaces are clustered on a background thread, and only the Qt thread touches Glue
+        self.stream_queue = queue.Queue()
+        self.space_done = lambda i, c: self.stream_queue.put((i, c))
+        self.cancel_event = threading.Event()
+
+        def work():
+            try:
+                if preview_points is not None:
+                    ind = stratified_subsample(len(self.data_df), preview_points, previous)
+                    self.preview(ind, lambda i, c: self.stream_queue.put(("preview", (i, c, ind))))
+                self.stream_queue.put(("done", self.compute()) if full else ("stopped", None))
+            except RunCancelled:
+                self.stream_queue.put(("stopped", None))
+            except Exception as e:
+                self.stream_queue.put(("error", e))
+
+        start_thread(work)
+        self.stream_timer = QTimer()
+        self.stream_timer.timeout.connect(self.poll_stream)
+        self.stream_timer.start(100)
+        if start:
+            self.ga.start(maximized=True)
+
+    def poll_stream(self):
+        """Adds the feature spaces clustered since the last call to the Glue application opened by
+        visualize_streaming(). Returns False once the background run has finished."""
+        import queue
+
+        while True:
+            try:
+                i, c = self.stream_queue.get_nowait()
+            except queue.Empty:
+                return True
+            if i == "error":
+                self.stop_stream()
+                raise c
+            if i == "stopped":
+                self.stop_stream()
+                return False
+            if i == "done":
+                # The master table holds the same columns as those already added, which keeps later reruns in line.
+                # The decimated dataset is drawn again now that the clusters are known
+                self.stop_stream()
+                self.set_results(c)
+                self.update_glue_datasets()
+                return False
+            if i == "preview":
+                i, c, ind = c
+                with self.span("stream preview " + self.feature_space_name[i], check_cancel=False):
+                    self.stream_space(i, c, ind)
+                continue
+            with self.span("stream " + self.feature_space_name[i], check_cancel=False):
+                self.stream_space(i, c)
+
+    def stream_space(self, i, c, ind=None):
+        """Shows the AstroLink result c of the i-th feature space in the running Glue application: sets its
+        ordered_index_*/log_rho_* columns, and draws its ordered-density viewer or redraws the one showing its
+        preview. If c is a preview, ind holds the points of the subsample it was run on."""
+        name = self.feature_space_name[i]
+        columns = self.space_columns(c)
+        if ind is not None:
+            # The points outside the subsample are not in the ordered list of the preview
+            previews = columns
+            columns = [np.full(len(self.data_df), np.nan, dtype=np.float32 if self.compact else np.float64)
+                       for _ in previews]
+            for values, preview in zip(columns, previews):
+                values[ind] = preview
+        self.set_space_data(i, columns)
+        if name in self.ordered_density_viewers:
+            self.replace_ordered_density(i, c)
+        else:
+            self.plot_ordered_density(i, c)
+        if ind is not None:
+            self.preview_spaces.add(name)
+            self.ordered_density_viewers[name][0].axes.set_title(self.ordered_density_title(i, len(ind)))
+
+    def cancel_stream(self):
+        """Stops the background run of visualize_streaming() before its next stage, e.g. after the previews, keeping
+        the results shown so far. AstroLink jobs running on the process pool of set_parallel() are terminated."""
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+
+    def stop_stream(self):
+        """Stops polling the background run of visualize_streaming()."""
+        if self.stream_timer is not None:
+            self.stream_timer.stop()
+        self.stream_timer = None
+        self.space_done = None
+        self.cancel_event = None
+
+    def save_session(self, path):
+        """Saves the session to the directory path, so that it can be reopened with load_session() without entering
+        the inputs or running AstroLink again. The directory holds a session.json manifest with the file path, the
+        feature spaces and their parameters and the plots, and one .npy file per AstroLink array. The data itself is
+        not copied, so the input file has to stay where it is."""
+        if len(self.astrolink_list) != len(self.feature_space_name):
+            raise ValueError("compute() has to be run before the session can be saved")
+        os.makedirs(path, exist_ok=True)
+        stat = os.stat(self.file_path)
+        manifest = {"file_path": self.file_path, "file_size": stat.st_size, "file_mtime_ns": stat.st_mtime_ns,
+                    "columns": [str(col) for col in self.data_df.columns], "file_columns": self.file_columns,
+                    "renamed_columns": self.renamed_columns,
+                    "compact": self.compact,
+                    "keys": [self.space_results[name][0] if name in self.space_results else None
+                             for name in self.feature_space_name]}
+        for name in SESSION_LISTS:
+            manifest[name] = getattr(self, name)
+        save_astrolink_list(path, self.astrolink_list)
+        with open(os.path.join(path, "session.json"), "w") as f:
+            json.dump(manifest, f, default=lambda o: o.item())
+
+    def load_session(self, path):
+        """Reopens a session saved with save_session(). The input file is loaded again (memory-mapped for a .npy
+        file, from its binary sidecar for a .csv file) and the AstroLink arrays are memory-mapped, so only the master
+        table is rebuilt. Returns the AstroGlueResults object to pass to visualize(). Feature spaces are only
+        clustered again by a later rerun() if they are edited."""
+        with open(os.path.join(path, "session.json")) as f:
+            manifest = json.load(f)
+        stat = os.stat(manifest["file_path"])
+        if (stat.st_size, stat.st_mtime_ns) != (manifest["file_size"], manifest["file_mtime_ns"]):
+            raise ValueError(manifest["file_path"] + " has changed since the session was saved")
+
+        with self.span("load", file_path=manifest["file_path"]):
+            if manifest.get("file_columns") is not None:
+                # Only the columns loaded when the session was saved, under their names in the file
+                renamed = manifest.get("renamed_columns", {})
+                columns = [renamed.get(col, col) for col in manifest["columns"]]
+                self.P = None
+                self.data_df = load_csv_columns(manifest["file_path"], columns, manifest["compact"])
+            else:
+                self.P, self.data_df = load_file(manifest["file_path"])
+        self.file_columns = manifest.get("file_columns")
+        self.renamed_columns = manifest.get("renamed_columns", {})
+        self.data_df.columns = manifest["columns"]
+        self.file_path = manifest["file_path"]
+        for name in SESSION_LISTS:
+            setattr(self, name, manifest[name])
+        self.compact = manifest["compact"]
+        self.load_input()
+
+        self.astrolink_list = load_astrolink_list(path, len(self.feature_space_name))
+        if any(c.n_samples != len(self.data_df) for c in self.astrolink_list):
+            raise ValueError(manifest["file_path"] + " does not hold the data the session was saved with")
+        self.space_results = {name: (key, c) for name, key, c in zip(self.feature_space_name, manifest["keys"],
+                                                                     self.astrolink_list) if key is not None}
+        self.master_df = None
+        self.changed_spaces = list(self.feature_space_name)
+        return self.prepare_results()
+
+    def set_results(self, results):
+        """Takes the master table, AstroLink results and plots of an AstroGlueResults object."""
+        self.master_df = results.master_df
+        self.astrolink_list = results.astrolink_list
+        self.feature_space_name = results.feature_space_name
+        self.ord_ind_l = results.ord_ind_l
+        self.log_rho_l = results.log_rho_l
+        self.var_plot_list = results.var_plot_list
+        self.type_l = results.type_l
+
+    def update_glue_data(self, data, df):
+        """Brings the components of the Glue Data object data in line with the columns of df in place: new columns are
+        added, columns that are gone are removed and numeric columns whose values changed are updated, so that the
+        viewers and subsets showing data follow. The input order key is always kept."""
+        from glue.core.component import Component
+
+        cids = {cid.label: cid for cid in data.main_components}
+        updates = {}
+        for col in df.columns:
+            values = df[col].to_numpy()
+            cid = cids.pop(str(col), None)
+            if cid is None:
+                data.add_component(self.glue_component(values), str(col))
+                continue
+            comp = data.get_component(cid)
+            if type(comp) is Component and not (np.may_share_memory(comp.data, values) or np.array_equal(comp.data, values)):
+                updates[cid] = values
+        if updates:
+            data.update_components(updates)
+        for label, cid in cids.items():
+            if label != "input order":
+                data.remove_component(cid)
+
+    def update_visualization(self, results):
+        """Updates the running Glue application in place with the results of a later call to compute(). Only the
+        columns and ordered-density viewers of feature spaces that were added, removed or in changed_spaces are
+        touched; the other viewers redraw themselves from the updated data."""
+        self.set_results(results)
+        for name in list(self.ordered_density_viewers):
+            if name not in self.feature_space_name:
+                viewer, renderer = self.ordered_density_viewers.pop(name)
+                self.ordered_density_renderers.remove(renderer)
+                viewer.close(warn=False)
+        with self.span("update Glue data"):
+            self.update_glue_datasets()
+        # The density maps are drawn from the master table, which was replaced
+        for j, (scatter, x, y, renderer) in enumerate(self.density_map_renderers):
+            renderer.remove()
+            self.density_map_renderers[j] = (scatter, x, y, self.draw_density_map(scatter, x, y))
+
+        for i, name in enumerate(self.feature_space_name):
+            if (name in self.ordered_density_viewers and name not in self.changed_spaces
+                    and name not in self.preview_spaces):
+                continue
+            with self.span("viewer Ordered-Density Plot " + name):
+                if name not in self.ordered_density_viewers:
+                    self.plot_ordered_density(i)
+                else:
+                    self.replace_ordered_density(i, self.astrolink_list[i])
+
+    def rerun(self):
+        """Runs compute() again after feature spaces were added, removed or edited, e.g. with set_variables(), which
+        only clusters the feature spaces that changed, and updates the running Glue application in place if there is
+        one. Returns the new AstroGlueResults object."""
+        results = self.compute()
+        if self.ga is not None:
+            self.update_visualization(results)
+        return results
+
+    def run(self, stream=False, preview_points=None, full=True):
+        """Runs AstroGlue. If inputs are provided usign set_variables() method, it directly opens Glueviz. If inputs are not
+        provided then it launches the tkinter GUI window prompting user to input all the required fields. If stream is
+        True and the inputs were provided using set_variables(), Glueviz is opened before AstroLink has run (see
+        visualize_streaming()). If preview_points is given, it also shows the clustering of a subsample of that many
+        points first, and with full False only that preview."""
+        # With set_projection(), set_variables() leaves a .csv file for compute() to read
+        if self.file_path is None or (self.data_df is None and not self.project) or self.feature_spaces is None:
+            results = self.tkinter_show()
+            if results is None:
+                return
+        elif stream or preview_points is not None or not full:
+            self.visualize_streaming(preview_points=preview_points, full=full)
+            return
+        else:
+            results = self.compute()
+        self.visualize(results)
 
     def tkinter_show(self):
-        global data_df,f2_row,f3_row,type_l,dropdown_l,feature_spaces,feature_space_name,adaptive_list,k_den_list,S_list,k_link_list,h_style_list,workers_list,verbose_list,groups_l
+        """Launches the tkinter GUI window. The file is read and AstroLink is run on worker threads, so the window stays
+        responsive and shows their progress. Returns the AstroGlueResults object of the run, or None if the window was
+        closed or the run cancelled before it finished."""
+        import tkinter as tk
+        from tkinter import (END, Button, Canvas, Checkbutton, Entry, Frame, IntVar, Label, LabelFrame, Listbox, OptionMenu,
+                             Scrollbar, StringVar, filedialog, messagebox, ttk)
+        import queue
+        import threading
+        import webbrowser
+
+        global data_df,P,f2_row,f3_row,type_l,dropdown_l,feature_spaces,feature_space_name,adaptive_list,k_den_list,S_list,k_link_list,h_style_list,workers_list,verbose_list,groups_l
         data_df = 0
+        P = None
         f2_row = -1
         f3_row = -1
         type_l = []
@@ -305,6 +1281,9 @@ class AstroGlue:
         workers_list = []
         verbose_list = []
         groups_l={}
+        outcome = {}
+        # Calls posted by the worker threads, which must not touch the widgets themselves
+        calls = queue.Queue()
 
         def get_groups():
             col_l = data_df.columns
@@ -333,24 +1312,81 @@ class AstroGlue:
             for widget in col_entry_inner_frame3.winfo_children():
                 widget.destroy()
             file_path = filedialog.askopenfilename(filetypes=[("NumPy files", "*.npy"), ("CSV files", "*.csv")])
+            outcome.pop("entries", None)
             if file_path:
                 basename = os.path.basename(file_path)
                 file_label.config(text=basename)
                 process_file(file_path)
 
-        def process_file(file_path):
-            global data_df
-            if file_path.endswith('.npy'):
-                data = np.load(file_path)
-                data_df = pd.DataFrame(data, columns=[f"col{i+1}" for i in range(data.shape[1])])
-            elif file_path.endswith('.csv'):
-                data_df = pd.read_csv(file_path)
-            root.after(0, update_ui, data_df)
-
-        def update_ui(df):
+        def poll_calls():
+            while True:
+                try:
+                    func, args = calls.get_nowait()
+                except queue.Empty:
+                    break
+                func(*args)
+            if "results" in outcome:
+                root.destroy()
+                return
+            root.after(100, poll_calls)
+
+        def set_status(text, busy=False, value=None, maximum=None):
+            status_label.config(text=text)
+            progress_bar.stop()
+            if busy:
+                progress_bar.config(mode="indeterminate")
+                progress_bar.start(10)
+            else:
+                progress_bar.config(mode="determinate", maximum=maximum or 1, value=value or 0)
+
+        def process_file(path):
+            global data_df, P
+            data_df, P = 0, None
+            set_status("Loading " + os.path.basename(path) + "...", busy=True)
+
+            def load():
+                # The first rows are shown as soon as they are parsed, while the whole file is still being read. For a
+                # .npy file data_df and self.P share one memory-mapped buffer, and a .csv file is read from its binary
+                # sidecar once it has one
+                try:
+                    preview = preview_file(path)
+                    calls.put((update_ui, (path, preview)))
+                    if self.project and not path.endswith('.npy'):
+                        # Only the column names are needed until the run starts, see set_projection()
+                        calls.put((file_loaded, (path, None, preview)))
+                    else:
+                        calls.put((file_loaded, (path,) + load_file(path)))
+                except Exception as e:
+                    calls.put((load_failed, (path, e)))
+
+            threading.Thread(target=load, daemon=True).start()
+
+        def update_ui(path, df):
+            # Ignore files that were replaced by another upload while they loaded
+            if path != file_path:
+                return
             display_table(df)
             display_column_entries(df)
 
+        def file_loaded(path, loaded_P, df):
+            global data_df, P
+            if path != file_path:
+                return
+            P, data_df = loaded_P, df
+            if self.project and not path.endswith('.npy'):
+                set_status("Found " + str(len(df.columns)) + " columns")
+            else:
+                set_status("Loaded " + str(len(df)) + " rows")
+            # "Save and Next" was clicked while the file was loading
+            if "entries" in outcome:
+                update_columns(outcome.pop("entries"))
+
+        def load_failed(path, error):
+            if path != file_path:
+                return
+            set_status("")
+            messagebox.showerror("AstroGlue", "Could not load " + os.path.basename(path) + ":\n" + str(error))
+
         def display_table(df):
             for item in tree.get_children():
                 tree.delete(item)
@@ -389,7 +1425,7 @@ class AstroGlue:
                 entry.bind("<KeyRelease>", lambda event, entries=entries: check_entries(entries))
                 entries.append(entry)
 
-            update_button = Button(col_entry_inner_frame, text="Save and Next", command=lambda: update_columns(entries, df),cursor="hand2")
+            update_button = Button(col_entry_inner_frame, text="Save and Next", command=lambda: update_columns(entries),cursor="hand2")
             update_button.grid(row=len(columns), column=0, columnspan=2, pady=10)
             if not file_path.endswith('.csv'):
                 update_button.grid_remove()  
@@ -401,7 +1437,12 @@ class AstroGlue:
                 else:
                     update_button.grid_remove()  
 
-        def update_columns(entries, df,f3_row=f3_row):
+        def update_columns(entries,f3_row=f3_row):
+            if not isinstance(data_df, pd.DataFrame):
+                outcome["entries"] = entries
+                set_status("Still loading, the columns are saved once it is done...", busy=True)
+                return
+            df = data_df
             new_columns = [entry.get() for entry in entries]
             df.columns = new_columns
             for widget in col_entry_inner_frame2.winfo_children():
@@ -788,7 +1829,9 @@ class AstroGlue:
         main_frame.grid_columnconfigure(2, weight=1, uniform="group1")
 
         def close_win():
-            root.destroy()
+            if not isinstance(data_df, pd.DataFrame):
+                set_status("Upload a file and wait for it to load first")
+                return
             len_plot_list = []
             var_plot_list =[]
             for i in dropdown_l:
@@ -800,7 +1843,16 @@ class AstroGlue:
                 var_plot_list.append(l1_list)
 
             #Reassigning all variables
-            self.data_df = data_df
+            # With set_projection() data_df only holds the first rows, and compute() reads the columns it needs by
+            # their names in the file
+            if self.project and not file_path.endswith('.npy'):
+                self.data_df = None
+                self.renamed_columns = {new: col for new, col in zip(data_df.columns, read_header(file_path))
+                                        if new != col}
+            else:
+                self.data_df = data_df
+                self.renamed_columns = {}
+            self.file_columns = None
             self.type_l = type_l
             self.feature_spaces = feature_spaces
             self.feature_space_name = feature_space_name
@@ -814,8 +1866,70 @@ class AstroGlue:
             self.groups_l = groups_l
             self.var_plot_list = var_plot_list
             self.file_path = file_path
+            self.P = P
+
+            # Run AstroLink on a worker thread, reporting every stage back to the window
+            steps = [0]
+
+            def on_progress(name):
+                if (name.startswith("AstroLink ") and name != "AstroLink pool") or name == "data_prep":
+                    steps[0] += 1
+                set_status("Running " + name + "...", value=steps[0], maximum=len(feature_spaces) + 1)
+
+            def work():
+                try:
+                    results = self.compute()
+                except RunCancelled:
+                    calls.put((run_cancelled, ()))
+                except Exception as e:
+                    calls.put((run_failed, (e,)))
+                else:
+                    calls.put((run_finished, (results,)))
+
+            self.cancel_event = threading.Event()
+            self.progress = lambda name: calls.put((on_progress, (name,)))
+            end_button.config(text="Cancel", command=cancel_run)
+            set_status("Starting...", busy=True)
+            start_thread(work)
+
+        def stop_run():
+            self.cancel_event = None
+            self.progress = None
+            end_button.config(text="Save Preferences and Start -->", command=close_win)
+
+        def cancel_run():
+            self.cancel_event.set()
+            set_status("Cancelling...", busy=True)
+
+        def run_finished(results):
+            stop_run()
+            outcome["results"] = results
+
+        def run_cancelled():
+            stop_run()
+            set_status("Cancelled")
+
+        def run_failed(error):
+            stop_run()
+            set_status("")
+            messagebox.showerror("AstroGlue", "AstroGlue failed:\n" + str(error))
+
+        def on_close():
+            if self.cancel_event is not None:
+                self.cancel_event.set()
+            root.destroy()
+
+        status_frame = Frame(root)
+        status_frame.pack(fill="x", padx=10)
+        status_label = Label(status_frame, text="", anchor="w")
+        status_label.pack(side="left", fill="x", expand=True)
+        progress_bar = ttk.Progressbar(status_frame, length=200)
+        progress_bar.pack(side="right", padx=5)
 
         end_button = Button(root,text="Save Preferences and Start -->",command = close_win,cursor="hand2",font=("Arial", 10))
         end_button.pack(padx=5,pady=1)
 
+        root.protocol("WM_DELETE_WINDOW", on_close)
+        root.after(100, poll_calls)
         root.mainloop()
+        return outcome.get("results")
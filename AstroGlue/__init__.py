@@ -1,4 +1,5 @@
 # The version file is generated automatically by setuptools_scm
 from AstroGlue._version import version as __version__
 from .AstroGlue import AstroGlue
+from .results import AstroGlueResults
 
@@ -1,7 +1,37 @@
+import argparse
+import sys
+
 from AstroGlue import AstroGlue
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="AstroGlue", description="Opens the AstroGlue GUI, or with the batch command "
+                                     "runs AstroLink over many files without it.")
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser("batch", help="run AstroLink on many files and save their results",
+                                description="Runs AstroLink on every input file with the feature spaces of a config "
+                                "file and saves each file's master table and AstroLink outputs to its own directory. "
+                                "Files that already have results are skipped, so an interrupted batch can be resumed "
+                                "by running the same command again.")
+    batch.add_argument("config", help="a .json or .toml file holding the set_variables() arguments")
+    batch.add_argument("files", nargs="+", help="input .npy or .csv files, or glob patterns such as 'snapshots/*.npy'")
+    batch.add_argument("-o", "--output", required=True, help="the directory the results are written to")
+    batch.add_argument("-j", "--jobs", type=int, default=1, help="the number of files processed at the same time")
+    batch.add_argument("--cores", type=int, default=-1, help="the total number of cores to use (default: all)")
+    batch.add_argument("--memory-limit", help="the memory limit of each file's process, e.g. 8G")
+    args = parser.parse_args(argv)
+
+    if args.command == "batch":
+        from AstroGlue.batch import expand_files, load_config, parse_size, run_batch
+
+        status = run_batch(load_config(args.config), expand_files(args.files), args.output, args.jobs, args.cores,
+                           parse_size(args.memory_limit))
+        failed = [f for f, s in status.items() if s["status"] == "failed"]
+        if failed:
+            print(f"{len(failed)} of {len(status)} files failed, see {args.output}/batch_status.json", file=sys.stderr)
+            sys.exit(1)
+        return
+
     c = AstroGlue()
     c.run()
 
@@ -0,0 +1,204 @@
+#Non-interactive runs of AstroGlue over many input files
+import glob
+import json
+import os
+import shutil
+import time
+import traceback
+
+import psutil
+
+from .parallel import spawn_context, split_cores
+
+#The set_variables() arguments a batch config holds, besides file_path and data_df
+CONFIG_KEYS = ("feature_spaces", "adaptive_list", "k_den_list", "S_list", "k_link_list", "h_style_list", "workers_list",
+               "verbose_list", "feature_space_name", "var_plot_list", "type_l")
+
+
+def load_config(path):
+    """Reads a batch config from a .json or .toml file. It holds the arguments of set_variables() other than file_path
+    and data_df, under the same names (var_plot_list and type_l may be left out), and optionally 'columns', the column
+    names given to the input files (.npy files have none, and those of .csv files are replaced), 'compact', the
+    argument of set_precision(), and 'project', the argument of set_projection()."""
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    else:
+        with open(path) as f:
+            config = json.load(f)
+    config.setdefault("var_plot_list", [])
+    config.setdefault("type_l", [])
+    missing = [key for key in CONFIG_KEYS if key not in config]
+    if missing:
+        raise ValueError(path + " is missing " + ", ".join(missing))
+    return config
+
+
+def expand_files(patterns):
+    """Returns the sorted input files matched by patterns, which are file paths or glob patterns."""
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        files.extend(matches if matches else [pattern])
+    return list(dict.fromkeys(files))
+
+
+def parse_size(size):
+    """Returns a size in bytes given as a number of bytes or as a string such as '512M' or '8G'."""
+    if size is None or isinstance(size, int):
+        return size
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def output_path(output_dir, file_path):
+    """Returns the directory into which the results of file_path are written."""
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(file_path))[0])
+
+
+def run_file(config, file_path, out_path):
+    """Runs AstroLink on file_path with config and saves the AstroGlueResults to out_path. The results are written to a
+    temporary directory that is loaded back and renamed when complete, so out_path only ever holds finished results
+    that can be opened."""
+    from .AstroGlue import AstroGlue
+    from .loaders import read_header
+    from .results import AstroGlueResults
+
+    ag = AstroGlue()
+    ag.set_precision(config.get("compact", False))
+    ag.set_projection(config.get("project", False))
+    ag.set_variables(file_path, None, *(config[key] for key in CONFIG_KEYS))
+    if "columns" in config and ag.data_df is None:
+        # set_projection() left the .csv file unread, so its columns are read by their names in the file
+        header = read_header(file_path)
+        if len(header) != len(config["columns"]):
+            raise ValueError(file_path + " has " + str(len(header)) + " columns, but the config names "
+                             + str(len(config["columns"])))
+        ag.renamed_columns = {new: col for new, col in zip(config["columns"], header) if new != col}
+    elif "columns" in config:
+        ag.data_df.columns = config["columns"]
+    results = ag.compute()
+    partial = out_path + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    results.save(partial)
+    AstroGlueResults.load(partial)
+    os.replace(partial, out_path)
+
+
+def _run_file_job(config, file_path, out_path):
+    """Runs run_file() in a worker process, writing the traceback of any error next to out_path."""
+    try:
+        run_file(config, file_path, out_path)
+    except BaseException:
+        with open(out_path + ".error", "w") as f:
+            f.write(traceback.format_exc())
+        raise
+
+
+def run_batch(config, files, output_dir, n_jobs=1, n_cores=-1, memory_limit=None, poll_interval=0.5):
+    """Runs AstroLink on every input file and saves each file's results (its master table and AstroLink outputs, see
+    AstroGlueResults.save()) to its own directory in output_dir.
+
+    Every file is processed in its own spawned process, at most n_jobs at a time, and feature spaces with workers=-1
+    get an equal share of the n_cores cores. A process whose resident memory exceeds memory_limit bytes is killed and
+    its file marked as failed. Files whose results are already in output_dir are skipped, so a batch that failed or
+    was interrupted can simply be run again. The status of every file is written to output_dir/batch_status.json.
+
+    Parameters
+    ---------
+    config : 'dict'
+            The set_variables() arguments, as returned by load_config().
+
+    files : 'list'
+            The input .npy or .csv files.
+
+    output_dir : 'str'
+            The directory the results are written to.
+
+    n_jobs : 'int'
+            The maximum number of files processed at the same time.
+
+    n_cores : 'int'
+            The total number of cores that can be used (-1 for all of them).
+
+    memory_limit : 'int'
+            The maximum resident memory of the process of one file in bytes, or None for no limit.
+
+    Returns
+    ---------
+    status : 'dict'
+            Maps every input file to its status: 'done', 'skipped' or 'failed', and for failures the error.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = [output_path(output_dir, f) for f in files]
+    if len(set(names)) != len(names):
+        raise ValueError("Input files must have distinct names, as their results are saved under their names")
+    n_jobs, workers = split_cores(max(len(files), 1), n_jobs, n_cores)
+    config = dict(config, workers_list=[workers if w == -1 else w for w in config["workers_list"]])
+
+    status = {}
+    status_path = os.path.join(output_dir, "batch_status.json")
+    # Keep the record of files finished by earlier runs
+    previous = {}
+    if os.path.isfile(status_path):
+        with open(status_path) as f:
+            previous = json.load(f)
+    todo = []
+    for file_path, out_path in zip(files, names):
+        if os.path.isfile(os.path.join(out_path, "manifest.json")):
+            status[file_path] = dict(previous.get(file_path, {}), status="skipped")
+        else:
+            todo.append((file_path, out_path))
+
+    context = spawn_context()
+    running = {}
+    n_done = len(status)
+    while todo or running:
+        while todo and len(running) < n_jobs:
+            file_path, out_path = todo.pop(0)
+            if os.path.exists(out_path + ".error"):
+                os.remove(out_path + ".error")
+            process = context.Process(target=_run_file_job, args=(config, file_path, out_path), daemon=True)
+            process.start()
+            running[file_path] = (process, out_path, time.perf_counter(), 0)
+        time.sleep(poll_interval)
+        for file_path, (process, out_path, start, peak) in list(running.items()):
+            error = None
+            if process.is_alive():
+                try:
+                    rss = psutil.Process(process.pid).memory_info().rss
+                except psutil.Error:
+                    rss = 0
+                peak = max(peak, rss)
+                running[file_path] = (process, out_path, start, peak)
+                if memory_limit is None or rss <= memory_limit:
+                    continue
+                process.kill()
+                process.join()
+                error = f"killed after exceeding the memory limit of {memory_limit / 2**20:.0f}MB"
+            elif process.exitcode != 0:
+                try:
+                    with open(out_path + ".error") as f:
+                        error = f.read()
+                except OSError:
+                    error = f"exited with code {process.exitcode}"
+            del running[file_path]
+            n_done += 1
+            entry = {"status": "failed" if error else "done", "wall_s": time.perf_counter() - start,
+                     "peak_rss_mb": peak / 2**20}
+            if error:
+                entry["error"] = error
+            status[file_path] = entry
+            print(f"[{n_done}/{len(files)}] {file_path}: {entry['status']} in {entry['wall_s']:.1f}s", flush=True)
+            with open(status_path, "w") as f:
+                json.dump(status, f, indent=1)
+    with open(status_path, "w") as f:
+        json.dump(status, f, indent=1)
+    return status
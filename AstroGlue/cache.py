@@ -0,0 +1,105 @@
+#On-disk cache of AstroLink results
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+#AstroLink parameters that do not change the clustering result and so are left out of the cache key
+IGNORED_PARAMS = ("workers", "verbose")
+
+
+class AstroLinkResult:
+    """The parts of a finished AstroLink run that AstroGlue uses. It can stand in for an AstroLink object wherever
+    AstroGlue reads logRho, ordering, clusters, ids and n_samples."""
+    def __init__(self, logRho, ordering, clusters, ids):
+        self.logRho = logRho
+        self.ordering = ordering
+        self.clusters = clusters
+        self.ids = ids
+        self.n_samples = len(logRho)
+
+    @classmethod
+    def from_astrolink(cls, c):
+        return cls(c.logRho, c.ordering, c.clusters, np.asarray(c.ids))
+
+
+class ResultCache:
+    """A content-addressed cache of AstroLink results stored as uncompressed .npz files.
+
+    Results are keyed by a hash of the clustered columns and the AstroLink parameters, so the same file, columns and
+    parameters are only ever clustered once. When the cache grows beyond max_bytes the least recently used results
+    are evicted.
+
+    Parameters
+    ---------
+    cache_dir : 'str'
+            The directory in which results are stored. Defaults to the ASTROGLUE_CACHE_DIR environment variable, or to
+            ~/.cache/AstroGlue.
+
+    max_bytes : 'int'
+            The maximum total size of the cached results in bytes.
+    """
+    def __init__(self, cache_dir=None, max_bytes=4 * 2**30):
+        if cache_dir is None:
+            cache_dir = os.environ.get("ASTROGLUE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "AstroGlue"))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(P, ind, params, chunk_rows=2**20):
+        """Returns the cache key of running AstroLink with params on the columns ind of P. The columns are hashed in
+        chunks of chunk_rows rows so that only one chunk is ever copied."""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(repr((P.shape[0], list(ind), P.dtype.str)).encode())
+        h.update(repr(sorted((k, str(v)) for k, v in params.items() if k not in IGNORED_PARAMS)).encode())
+        for start in range(0, P.shape[0], chunk_rows):
+            h.update(np.ascontiguousarray(P[start:start + chunk_rows, ind]).data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        """Returns the cached AstroLinkResult for key, or None if there is none."""
+        path = self.path(key)
+        try:
+            with np.load(path) as f:
+                result = AstroLinkResult(f["logRho"], f["ordering"], f["clusters"], f["ids"])
+        except (OSError, KeyError, ValueError):
+            return None
+        # The modification time records when a result was last used
+        os.utime(path)
+        return result
+
+    def put(self, key, c):
+        """Stores the result of the AstroLink run c under key and evicts old results if the cache is full."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, logRho=c.logRho, ordering=c.ordering, clusters=c.clusters, ids=np.asarray(c.ids))
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used results until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Removes every cached result."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,103 @@
+#Index of the cluster hierarchy of an AstroLink result
+import numpy as np
+
+
+class ClusterHierarchy:
+    """The tree of the clusters of an AstroLink result, built from their [start, end) ranges in the ordered list.
+
+    Clusters are nested ranges of c.ordering, so a point is in a cluster if and only if its position in the ordered
+    list falls in the range of that cluster. The tree is built with one pass over the clusters sorted by start, and
+    membership tests only compare a position against the two ends of a range.
+
+    Parameters
+    ---------
+    c : 'AstroLink object'
+            The AstroLink object (or AstroLinkResult object) whose clusters are indexed.
+
+    Attributes
+    ---------
+    ids : 'list'
+            The id strings of the clusters, e.g. '1-2-1'. Clusters are referred to by their position in this list.
+
+    parent : 'numpy array'
+            The position of the parent of every cluster, or -1 for the root.
+
+    children : 'list'
+            The positions of the children of every cluster.
+    """
+    def __init__(self, c):
+        self.source = c
+        self.ordering = np.asarray(c.ordering)
+        self.clusters = np.asarray(c.clusters, dtype=np.int64)
+        self.n_samples = c.n_samples
+        self.ids = [str(i) for i in c.ids]
+        self.index = {cid: k for k, cid in enumerate(self.ids)}
+        # Parents before children: by start, and the larger of two clusters starting together first
+        self.order = np.lexsort((self.clusters[:, 0] - self.clusters[:, 1], self.clusters[:, 0]))
+        self.parent = np.full(len(self.clusters), -1, dtype=np.int32)
+        self.children = [[] for _ in self.ids]
+        stack = []
+        for k in self.order:
+            s, e = self.clusters[k]
+            while stack and s >= self.clusters[stack[-1], 1]:
+                stack.pop()
+            if stack:
+                self.parent[k] = stack[-1]
+                self.children[stack[-1]].append(int(k))
+            stack.append(k)
+        self._position = None
+
+    def find(self, cluster):
+        """Returns the position of cluster, given either as an id string or as a position."""
+        return self.index[cluster] if isinstance(cluster, str) else int(cluster)
+
+    def range(self, cluster):
+        """Returns the [start, end) range of cluster in the ordered list."""
+        s, e = self.clusters[self.find(cluster)]
+        return int(s), int(e)
+
+    def members(self, cluster):
+        """Returns the indices of the points of cluster, as a view of the ordering."""
+        s, e = self.range(cluster)
+        return self.ordering[s:e]
+
+    def size(self, cluster):
+        """Returns the number of points of cluster."""
+        s, e = self.range(cluster)
+        return e - s
+
+    def ancestors(self, cluster):
+        """Returns the positions of the ancestors of cluster, from its parent up to the root."""
+        out = []
+        k = self.parent[self.find(cluster)]
+        while k != -1:
+            out.append(int(k))
+            k = self.parent[k]
+        return out
+
+    @property
+    def position(self):
+        """The position of every point in the ordered list, i.e. the inverse permutation of the ordering."""
+        if self._position is None:
+            dtype = np.int32 if self.n_samples < 2**31 else np.int64
+            self._position = np.empty(self.n_samples, dtype=dtype)
+            self._position[self.ordering] = np.arange(self.n_samples, dtype=dtype)
+        return self._position
+
+    def contains(self, cluster, points):
+        """Returns whether the points (an index or an array of indices) are in cluster."""
+        s, e = self.range(cluster)
+        pos = self.position[points]
+        return (pos >= s) & (pos < e)
+
+    def labels(self):
+        """Returns the position of the deepest cluster of every point as an int32 array in input order. Points that are
+        in no cluster besides the root get the position of the root."""
+        ordered = np.zeros(self.n_samples, dtype=np.int32)
+        # Children come after their parents, so they overwrite them
+        for k in self.order:
+            s, e = self.clusters[k]
+            ordered[s:e] = k
+        labels = np.empty(self.n_samples, dtype=np.int32)
+        labels[self.ordering] = ordered
+        return labels
@@ -0,0 +1,104 @@
+#Timing and memory instrumentation of the stages of AstroGlue
+import contextlib
+import json
+import os
+import threading
+import time
+
+import psutil
+
+
+class PeakRSS:
+    """Measures the peak resident set size of the process inside a with-block by polling it from a thread."""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+
+    def __enter__(self):
+        self.start = self.peak = self.process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+        self.delta = self.peak - self.start
+
+
+class Span:
+    """A finished stage: its name, start time (seconds since the tracer was created), wall time and CPU time in seconds,
+    the peak RSS of the process while it ran and how much that exceeded the RSS at its start, in bytes, and any extra
+    arguments it was opened with."""
+    def __init__(self, name, start, wall, cpu, peak_rss, rss_growth, thread, args):
+        self.name = name
+        self.start = start
+        self.wall = wall
+        self.cpu = cpu
+        self.peak_rss = peak_rss
+        self.rss_growth = rss_growth
+        self.thread = thread
+        self.args = args
+
+    def __repr__(self):
+        return (f"Span({self.name!r}, wall={self.wall:.3f}s, cpu={self.cpu:.3f}s, "
+                f"peak_rss={self.peak_rss / 2**20:.0f}MB, rss_growth={self.rss_growth / 2**20:.0f}MB)")
+
+
+class Tracer:
+    """Records named spans around the stages of AstroGlue.
+
+    Parameters
+    ---------
+    callback : 'callable'
+            Called with every Span as soon as it finishes.
+
+    trace_path : 'str'
+            If given, all spans recorded so far are written to this file in the Chrome trace event format (viewable in
+            chrome://tracing or https://ui.perfetto.dev) every time a span finishes.
+    """
+    def __init__(self, callback=None, trace_path=None):
+        self.callback = callback
+        self.trace_path = trace_path
+        self.spans = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """Context manager recording the wall time, CPU time and peak RSS of its block as a span called name."""
+        with PeakRSS() as mem:
+            start, cpu = time.perf_counter(), time.process_time()
+            try:
+                yield
+            finally:
+                wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+        span = Span(name, start - self._origin, wall, cpu, mem.peak, mem.delta, threading.get_ident(), args)
+        with self._lock:
+            self.spans.append(span)
+        if self.callback is not None:
+            self.callback(span)
+        if self.trace_path is not None:
+            self.save_chrome_trace(self.trace_path)
+
+    def chrome_trace(self):
+        """Returns the recorded spans as a Chrome trace event dictionary."""
+        pid = os.getpid()
+        events = []
+        for s in self.spans:
+            args = {"cpu_s": s.cpu, "peak_rss_mb": s.peak_rss / 2**20, "rss_growth_mb": s.rss_growth / 2**20}
+            args.update({k: str(v) for k, v in s.args.items()})
+            events.append({"name": s.name, "ph": "X", "ts": s.start * 1e6, "dur": s.wall * 1e6, "pid": pid,
+                           "tid": s.thread, "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        """Writes the recorded spans to path in the Chrome trace event format."""
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
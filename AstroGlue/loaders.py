@@ -0,0 +1,237 @@
+#Loading of input files into arrays and dataframes that share one buffer
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+def load_npy(file_path):
+    """Memory-maps a .npy file read-only, so that its data is only read from disk as it is used."""
+    return np.load(file_path, mmap_mode="r")
+
+
+def array_to_df(P, columns=None):
+    """Wraps the 2D array P in a dataframe without copying it. By default the columns are named col1, col2, ..."""
+    if columns is None:
+        columns = [f"col{i+1}" for i in range(P.shape[1])]
+    return pd.DataFrame(P, columns=columns, copy=False)
+
+
+def column_major(data, dtype=None):
+    """Copies the columns of a dataframe or 2D array into a single column-major (Fortran-ordered) 2D array of the given
+    dtype, one column at a time, so that every column of the result is contiguous and no row-major copy of the whole
+    table is ever made. By default the dtype is the common dtype of the columns."""
+    if isinstance(data, pd.DataFrame):
+        columns = [data.iloc[:, j] for j in range(data.shape[1])]
+        dtypes = data.dtypes
+    else:
+        columns = [data[:, j] for j in range(data.shape[1])]
+        dtypes = [data.dtype]
+    if dtype is None:
+        try:
+            dtype = np.result_type(*[np.dtype(t) for t in dtypes])
+        except TypeError:
+            dtype = object
+    P = np.empty(data.shape, dtype=dtype, order="F")
+    for j, col in enumerate(columns):
+        P[:, j] = np.asarray(col, dtype=dtype)
+    return P
+
+
+def check_float32(data_df):
+    """Raises a ValueError naming the integer columns of data_df that float32 cannot store exactly, i.e. those with
+    values beyond 2**24 in magnitude, such as large IDs."""
+    inexact = []
+    for col in data_df.columns:
+        values = data_df[col].to_numpy()
+        if values.dtype.kind in "iu" and len(values) > 0 and max(-int(values.min()), int(values.max())) > 2**24:
+            inexact.append(str(col))
+    if inexact:
+        raise ValueError("The integer columns " + ", ".join(inexact) + " hold values beyond 2**24, which float32 cannot "
+                         "store exactly. Call set_precision(False), or leave them out with set_projection().")
+
+
+def column_slice(P, ind):
+    """Returns the columns ind of P. A run of consecutive columns is returned as a view of P and any other selection as
+    a single copy of just those columns."""
+    ind = list(ind)
+    if len(ind) > 0 and ind == list(range(ind[0], ind[0] + len(ind))):
+        return P[:, ind[0]:ind[0] + len(ind)]
+    return P[:, ind]
+
+
+def astrolink_input(X):
+    """Returns X as the array AstroLink clusters: float64 arrays are passed as they are, and anything else, including
+    the float32 data of set_precision(), is converted to a float64 copy, so that the clustering does not depend on
+    how the data is stored."""
+    return np.asarray(X, dtype=np.float64)
+
+
+#Bumped whenever the layout of the CSV sidecar changes, so that old sidecars are rebuilt
+SIDECAR_VERSION = 1
+
+
+def sidecar_path(file_path):
+    """Returns the path of the binary sidecar directory of a .csv file."""
+    return file_path + ".astroglue"
+
+
+def save_column(path, series):
+    """Saves the dataframe column series to path + '.npy' and returns its kind. Numeric columns are saved as they are,
+    kind 'array'. Text columns, which numpy cannot memory-map as objects, are saved as fixed-width unicode together
+    with their missing values in path + '.null.npy', kind 'text'."""
+    if series.dtype.kind in "biufcmM":
+        np.save(path + ".npy", series.to_numpy())
+        return "array"
+    null = series.isna().to_numpy()
+    np.save(path + ".npy", np.where(null, "", series.astype(object)).astype(str))
+    np.save(path + ".null.npy", null)
+    return "text"
+
+
+def load_column(path, dtype, kind, mmap_mode="r"):
+    """Loads a column saved with save_column() as a numpy array, or for a text column a series of the given dtype.
+    Numeric columns are memory-mapped unless mmap_mode is None."""
+    # np.asarray drops the memmap subclass but keeps the mapping
+    values = np.asarray(np.load(path + ".npy", mmap_mode=mmap_mode))
+    if kind != "text":
+        return values
+    values = values.astype(object)
+    values[np.load(path + ".null.npy")] = np.nan
+    values = pd.Series(values, dtype=object)
+    return values if dtype == "object" else values.astype(dtype)
+
+
+def read_sidecar(file_path, columns=None):
+    """Returns the dataframe stored in the sidecar of file_path, or None if there is no sidecar or the file has changed
+    since it was written. Numeric columns are memory-mapped. If columns is given, only those columns are read, in that
+    order."""
+    path = sidecar_path(file_path)
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        st = os.stat(file_path)
+        if meta["version"] != SIDECAR_VERSION or meta["size"] != st.st_size or meta["mtime_ns"] != st.st_mtime_ns:
+            return None
+        wanted = None if columns is None else set(columns)
+        data = {}
+        for i, (col, dtype, kind) in enumerate(zip(meta["columns"], meta["dtypes"], meta["kinds"])):
+            if wanted is not None and col not in wanted:
+                continue
+            data[col] = load_column(os.path.join(path, str(i)), dtype, kind)
+        if columns is not None:
+            data = {col: data[col] for col in columns}
+    except (OSError, KeyError, ValueError):
+        return None
+    return pd.DataFrame(data, copy=False)
+
+
+def write_sidecar(file_path, df):
+    """Stores df as the sidecar of file_path: one .npy file per column (see save_column()) plus a meta.json holding the
+    column names, their dtypes and kinds and the size and modification time of file_path."""
+    path = sidecar_path(file_path)
+    st = os.stat(file_path)
+    meta = {"version": SIDECAR_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "columns": [str(col) for col in df.columns], "dtypes": [], "kinds": []}
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        for i, col in enumerate(df.columns):
+            series = df.iloc[:, i]
+            meta["dtypes"].append(str(series.dtype))
+            meta["kinds"].append(save_column(os.path.join(tmp_path, str(i)), series))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def load_csv(file_path, sidecar=True):
+    """Reads a .csv file into a dataframe. The first read converts it into a binary sidecar next to the file (see
+    write_sidecar()), which later reads use for as long as the size and modification time of the file are unchanged."""
+    if not sidecar:
+        return pd.read_csv(file_path)
+    df = read_sidecar(file_path)
+    if df is None:
+        df = pd.read_csv(file_path)
+        try:
+            write_sidecar(file_path, df)
+        except OSError:
+            pass
+    return df
+
+
+def read_header(file_path):
+    """Returns the column names of a .csv file, reading only its first line."""
+    return [str(col) for col in pd.read_csv(file_path, nrows=0).columns]
+
+
+def csv_dtypes(file_path, columns, compact=False, n_rows=1000):
+    """Returns the dtypes columns of a .csv file are parsed as, guessed from its first n_rows rows: the floating-point
+    columns are parsed as float32 if compact is True and as float64 otherwise, and the integer columns as int64, so
+    that check_float32() can still see their exact values. The other columns are left to the parser."""
+    head = pd.read_csv(file_path, usecols=columns, nrows=n_rows)
+    dtypes = {}
+    for col in columns:
+        kind = head[col].dtype.kind
+        if kind == "f":
+            dtypes[col] = np.float32 if compact else np.float64
+        elif kind in "iu":
+            dtypes[col] = np.int64
+    return dtypes
+
+
+def read_csv_columns(file_path, columns, compact=False):
+    """Parses only columns of a .csv file, with the dtypes of csv_dtypes(), and returns them in the given order. The
+    multi-threaded pyarrow parser is used if pyarrow is installed, and pandas' C parser otherwise. If a column does not
+    fit the dtype guessed from its first rows, the columns are parsed again with the dtypes the parser infers."""
+    try:
+        import pyarrow  # noqa: F401
+        engine = "pyarrow"
+    except ImportError:
+        engine = "c"
+    columns = list(columns)
+    try:
+        df = pd.read_csv(file_path, usecols=columns, dtype=csv_dtypes(file_path, columns, compact), engine=engine)
+    except ValueError:
+        df = pd.read_csv(file_path, usecols=columns, engine=engine)
+    return df[columns]
+
+
+def load_csv_columns(file_path, columns, compact=False):
+    """Reads only columns of a .csv file. They are taken from the binary sidecar of the file if it has one holding them
+    (see load_csv()), and parsed with read_csv_columns() otherwise. A sidecar is only written by reads of the whole
+    file."""
+    df = read_sidecar(file_path, columns)
+    if df is None:
+        df = read_csv_columns(file_path, columns, compact)
+    return df
+
+
+def preview_file(file_path, n_rows=50):
+    """Returns a dataframe of the first n_rows rows of a .npy or .csv file, named like the one load_file() returns,
+    without reading the rest of the file."""
+    if file_path.endswith('.npy'):
+        return array_to_df(np.array(load_npy(file_path)[:n_rows]))
+    return pd.read_csv(file_path, nrows=n_rows)
+
+
+def load_file(file_path):
+    """Loads a .npy or .csv file.
+
+    Returns
+    ---------
+    (P, data_df) : 'tuple'
+            For a .npy file, the memory-mapped array and a dataframe sharing its buffer. For a .csv file, P is None
+            and data_df is read through load_csv().
+    """
+    if file_path.endswith('.npy'):
+        P = load_npy(file_path)
+        return P, array_to_df(P)
+    return None, load_csv(file_path)
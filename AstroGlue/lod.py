@@ -0,0 +1,111 @@
+#Level of detail for the 3D scatter viewers of large datasets
+import numpy as np
+
+
+def stratified_subsample(n_samples, max_points, astrolink_list, min_cluster_points=10, seed=0):
+    """Returns the sorted indices of a subsample of at most max_points of the n_samples points, stratified by AstroLink
+    cluster: every cluster of every feature space first gets min_cluster_points of its points (or all of them if it is
+    smaller), and the rest of the budget is drawn uniformly from the remaining points, so that the clusters keep their
+    relative sizes. If the clusters alone need more than max_points, all of their points are kept anyway.
+
+    Parameters
+    ---------
+    n_samples : 'int'
+            The number of points in the dataset.
+
+    max_points : 'int'
+            The point budget of the subsample.
+
+    astrolink_list : 'list'
+            The AstroLink objects (or AstroLinkResult objects) whose clusters must be represented.
+
+    min_cluster_points : 'int'
+            The number of points kept from every cluster.
+
+    seed : 'int'
+            The seed of the random number generator, so that the same subsample is drawn every time.
+    """
+    if n_samples <= max_points:
+        return np.arange(n_samples)
+    rng = np.random.default_rng(seed)
+    keep = np.zeros(n_samples, dtype=bool)
+    for c in astrolink_list:
+        ordering = np.asarray(c.ordering)
+        for s, e in np.asarray(c.clusters)[1:]:
+            keep[ordering[s + rng.choice(e - s, min(e - s, min_cluster_points), replace=False)]] = True
+    n_rest = max_points - np.count_nonzero(keep)
+    if n_rest > 0:
+        keep[rng.choice(np.flatnonzero(~keep), n_rest, replace=False)] = True
+    return np.flatnonzero(keep)
+
+
+class LevelOfDetail:
+    """Switches the subset layers of the 3D scatter viewers between a decimated dataset and the full dataset.
+
+    The viewers show the decimated dataset, and the full dataset is added to them with its own layer hidden. Whenever a
+    subset changes, its layer from the full dataset is shown if the subset has at most max_points points, and its layer
+    from the decimated dataset otherwise, so that small selections are drawn at full resolution.
+
+    Parameters
+    ---------
+    dc : 'glue DataCollection'
+            The data collection holding both datasets.
+
+    full : 'glue Data'
+            The full dataset.
+
+    lod : 'glue Data'
+            The decimated dataset, joined to the full one so that subsets carry over between them.
+
+    indices : 'numpy array'
+            The rows of the full dataset that make up the decimated one.
+
+    max_points : 'int'
+            The largest subset drawn at full resolution.
+    """
+    def __init__(self, dc, full, lod, indices, max_points):
+        from glue.core.hub import HubListener
+
+        self.hub = dc.hub
+        self.full = full
+        self.lod = lod
+        self.indices = indices
+        self.max_points = max_points
+        self.viewers = []
+        self.full_resolution = {}
+        # The hub only keeps a weak reference to its subscribers
+        self._listener = HubListener()
+
+    def add_viewer(self, viewer):
+        """Adds a 3D scatter viewer showing the decimated dataset. The full dataset is added to it, hidden."""
+        from glue.core.message import SubsetCreateMessage, SubsetUpdateMessage
+
+        viewer.add_data(self.full)
+        for layer in viewer.layers:
+            if layer.layer is self.full:
+                layer.state.visible = False
+        self.viewers.append(viewer)
+        # The hub calls its subscribers in the order they subscribed, and the viewers must add the layers of a new
+        # subset before they are switched
+        self.hub.unsubscribe_all(self._listener)
+        for message in (SubsetCreateMessage, SubsetUpdateMessage):
+            self.hub.subscribe(self._listener, message, handler=self.update,
+                               filter=lambda msg: msg.subset.data is self.full or msg.subset.data is self.lod)
+        self.update()
+
+    def close(self):
+        """Stops switching the subset layers, e.g. before the decimated dataset is replaced."""
+        self.hub.unsubscribe_all(self._listener)
+
+    def update(self, message=None):
+        """Recounts the subset in message if it belongs to the full dataset, and shows the layers of each subset at the
+        right resolution."""
+        if message is not None and message.subset.data is self.full:
+            subset = message.subset
+            self.full_resolution[subset.group] = np.count_nonzero(subset.to_mask()) <= self.max_points
+        for viewer in self.viewers:
+            for layer in viewer.layers:
+                group = getattr(layer.layer, "group", None)
+                if group is None or group not in self.full_resolution:
+                    continue
+                layer.state.visible = self.full_resolution[group] == (layer.layer.data is self.full)
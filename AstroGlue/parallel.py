@@ -0,0 +1,152 @@
+#Helpers for running the AstroLink jobs of several feature spaces concurrently
+import contextlib
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .loaders import astrolink_input
+
+
+class RunCancelled(Exception):
+    """Raised when a run of AstroGlue is cancelled through its cancel_event."""
+
+
+def split_cores(n_spaces, n_jobs=-1, n_cores=-1):
+    """Splits a core budget between concurrently running AstroLink jobs.
+
+    Parameters
+    ---------
+    n_spaces : 'int'
+            The number of feature spaces to be clustered.
+
+    n_jobs : 'int'
+            The maximum number of AstroLink jobs that run at the same time. If -1, every feature space gets its own job.
+
+    n_cores : 'int'
+            The total number of cores that can be used. If -1, all the cores of the machine are used.
+
+    Returns
+    ---------
+    (n_jobs, workers) : 'tuple'
+            The number of concurrent jobs and the number of cores each of them can use.
+    """
+    if n_cores == -1:
+        n_cores = os.cpu_count() or 1
+    if n_jobs == -1:
+        n_jobs = n_spaces
+    n_jobs = max(1, min(n_jobs, n_spaces, n_cores))
+    return n_jobs, max(1, n_cores // n_jobs)
+
+
+def start_thread(target):
+    """Runs target on a daemon thread and returns the thread. numba's thread pool is started on the calling thread
+    first, since the TBB threading layer keeps the interpreter from exiting once it was started from another thread."""
+    import numba
+
+    numba.get_num_threads()
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def spawn_context():
+    """Returns the multiprocessing context worker processes are started with. Forking after numba has started its
+    threading layer is unsafe, so workers are always spawned."""
+    return multiprocessing.get_context("spawn")
+
+
+@contextlib.contextmanager
+def shared_pool(arrays, n_jobs):
+    """Copies arrays into shared memory and starts a pool of n_jobs spawned worker processes. Yields the pool and the
+    spec of every shared array, which the workers pass to read_shared(). The pool is terminated and the shared memory
+    released when the block is left."""
+    shms = []
+    specs = []
+    try:
+        for a in arrays:
+            a = np.asarray(a)
+            shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+            shms.append(shm)
+            # Assigned straight into the shared buffer, so a column-major array is not first copied to row-major order
+            np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+            specs.append((shm.name, a.shape, a.dtype.str))
+        with spawn_context().Pool(n_jobs) as pool:
+            yield pool, specs
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def read_shared(spec, key=Ellipsis):
+    """Returns a copy of the part key of an array shared by shared_pool(). Executed in a pool worker."""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        a = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        out = a[key]
+        # Basic indexing gives a view, and no view of the shared buffer may outlive this block
+        if np.may_share_memory(out, a):
+            out = out.copy()
+        del a
+    finally:
+        shm.close()
+    return out
+
+
+def _run_job(spec, ind, params):
+    """Runs AstroLink on the columns ind of the array shared through spec. Executed in a pool worker."""
+    from astrolink import AstroLink
+
+    c = AstroLink(astrolink_input(read_shared(spec, (slice(None), ind))), **params)
+    c.run()
+    # The feature-space slice is a copy that AstroGlue never reads back, so do not send it to the parent
+    c.P = None
+    return c
+
+
+def run_astrolink_pool(P, indices, params_list, n_jobs=-1, n_cores=-1, cancel=None, on_done=None):
+    """Runs AstroLink on several column subsets of P on a process pool.
+
+    P is copied once into shared memory (see shared_pool()), from which every worker takes the columns of its feature
+    space, so the input array is never pickled. Parameters with workers=-1 are given their share of the core budget (see split_cores()).
+    If the threading.Event cancel is set while the jobs run, the workers are terminated and RunCancelled is raised, and
+    on_done, if given, is called with the position of every job in indices and its AstroLink object as soon as it
+    finishes.
+
+    Parameters
+    ---------
+    P : 'numpy array'
+            The (n_samples, n_columns) input array.
+
+    indices : 'list'
+            A list of lists containing the column indices of each feature space.
+
+    params_list : 'list'
+            A list of dictionaries containing the AstroLink keyword arguments of each feature space.
+
+    Returns
+    ---------
+    astrolink_list : 'list'
+            The finished AstroLink objects, in the same order as indices.
+    """
+    n_jobs, workers = split_cores(len(indices), n_jobs, n_cores)
+    with shared_pool([P], n_jobs) as (pool, (spec,)):
+        jobs = []
+        for j, (ind, params) in enumerate(zip(indices, params_list)):
+            params = dict(params)
+            if params.get("workers", -1) == -1:
+                params["workers"] = workers
+            callback = None if on_done is None else (lambda c, j=j: on_done(j, c))
+            jobs.append(pool.apply_async(_run_job, (spec, ind, params), callback=callback))
+        results = []
+        for job in jobs:
+            while cancel is not None and not job.ready():
+                if cancel.wait(0.1):
+                    # Leaving the with-block terminates the workers
+                    raise RunCancelled()
+            results.append(job.get())
+        return results
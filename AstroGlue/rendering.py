@@ -0,0 +1,268 @@
+#Screen-resolution rendering of AstroLink ordered-density plots
+import numpy as np
+
+
+class OrderedDensityRenderer:
+    """Draws an AstroLink ordered-density plot onto a matplotlib axes at the resolution of the screen.
+
+    Instead of one vertex per point, the ordered log-density is reduced to a min/max envelope with one bin per pixel
+    column of the visible range, and every cluster is drawn as a polygon over the same bins. The envelope is recomputed
+    whenever the x-limits or the size of the figure change, so zooming in brings back the full detail of the visible
+    range while the number of vertices drawn stays bounded by the width of the axes. A min/max pyramid over the ordered
+    log-density keeps the recomputation independent of the number of points, and the parts of a bin that a cluster only
+    partly covers are reduced exactly, so that clusters narrower than a pixel keep their true height.
+
+    Parameters
+    ---------
+    ax : 'matplotlib axes'
+            The axes to draw on.
+
+    logRho_ordered : 'numpy array'
+            The log-density of the points in the AstroLink ordered list, i.e. logRho[ordering].
+
+    clusters : 'numpy array'
+            The (n_clusters, 2) [start, end) ranges of the AstroLink clusters in the ordered list, the root cluster first.
+
+    colors : 'list'
+            The fill colour of each cluster after the root cluster, which is drawn in black.
+    """
+    def __init__(self, ax, logRho_ordered, clusters, colors, min_block=16):
+        from matplotlib.collections import PolyCollection
+
+        self.ax = ax
+        self.y = np.asarray(logRho_ordered)
+        self.n = len(self.y)
+        self.clusters = np.asarray(clusters, dtype=np.int64)[1:]
+        self.colors = list(colors)
+        self.min_block = min_block
+        self.build_pyramid()
+        self.clusters_min = np.array([self.range_extrema(s, e)[0] for s, e in self.clusters])
+
+        self.root = PolyCollection([], facecolors='k', edgecolors='none', zorder=1)
+        self.fills = PolyCollection([], edgecolors='none', zorder=1)
+        ax.add_collection(self.root)
+        ax.add_collection(self.fills)
+        self.line, = ax.plot([], [], 'k-', lw=0.1, zorder=2)
+        self._xlim_cid = ax.callbacks.connect('xlim_changed', self.update)
+        self._resize_cid = ax.figure.canvas.mpl_connect('resize_event', self.update)
+
+    def remove(self):
+        """Removes the plot from the axes and stops following their zoom."""
+        self.ax.callbacks.disconnect(self._xlim_cid)
+        self.ax.figure.canvas.mpl_disconnect(self._resize_cid)
+        for artist in (self.root, self.fills, self.line):
+            artist.remove()
+
+    def build_pyramid(self):
+        """Builds the min/max pyramid: level k holds the extrema of consecutive blocks of min_block * 2**k points."""
+        self.levels = []
+        block = self.min_block
+        n_blocks = self.n // block
+        if n_blocks == 0:
+            return
+        blocks = self.y[:n_blocks * block].reshape(n_blocks, block)
+        mins, maxs = blocks.min(axis=1), blocks.max(axis=1)
+        while True:
+            self.levels.append((block, mins, maxs))
+            if len(mins) < 2:
+                break
+            m = len(mins) // 2
+            mins = np.minimum(mins[0:2 * m:2], mins[1:2 * m:2])
+            maxs = np.maximum(maxs[0:2 * m:2], maxs[1:2 * m:2])
+            block *= 2
+
+    def range_extrema(self, s, e):
+        """Returns the exact (min, max) of the ordered log-density over [s, e)."""
+        lo, hi = np.inf, -np.inf
+        if s >= e:
+            return lo, hi
+        b = self.min_block
+        bs, be = -(-s // b), e // b
+        if not self.levels or bs >= be:
+            part = self.y[s:e]
+            return part.min(), part.max()
+        for part in (self.y[s:bs * b], self.y[be * b:e]):
+            if len(part):
+                lo, hi = min(lo, part.min()), max(hi, part.max())
+        k = 0
+        while bs < be:
+            _, mins, maxs = self.levels[k]
+            if bs & 1:
+                lo, hi = min(lo, mins[bs]), max(hi, maxs[bs])
+                bs += 1
+            if be & 1:
+                be -= 1
+                lo, hi = min(lo, mins[be]), max(hi, maxs[be])
+            bs >>= 1
+            be >>= 1
+            k += 1
+        return lo, hi
+
+    def envelope(self, a, b, width):
+        """Splits [a, b) into at most width bins and returns the bin edges and the min and max of each bin."""
+        span = b - a
+        width = max(1, min(int(width), span))
+        edges = a + (np.arange(width + 1) * span) // width
+        level = None
+        for lv in self.levels:
+            if lv[0] <= span / width:
+                level = lv
+        if level is None:
+            mins = np.minimum.reduceat(self.y[a:b], edges[:-1] - a)
+            maxs = np.maximum.reduceat(self.y[a:b], edges[:-1] - a)
+            return edges, mins, maxs
+
+        # Each bin is approximated by the pyramid blocks starting inside it, which is exact to within one block
+        block, lmins, lmaxs = level
+        lmins, lmaxs = lmins[:-(-b // block)], lmaxs[:-(-b // block)]
+        starts = edges[:-1] // block
+        valid = starts < len(lmins)
+        mins = np.full(width, np.inf)
+        maxs = np.full(width, -np.inf)
+        mins[valid] = np.minimum.reduceat(lmins, starts[valid])
+        maxs[valid] = np.maximum.reduceat(lmaxs, starts[valid])
+        # The points after the last full block are not in the pyramid
+        n_full = len(self.levels[0][1]) * self.min_block
+        if b > n_full:
+            lo, hi = self.range_extrema(max(edges[-2], n_full), b)
+            mins[-1], maxs[-1] = min(mins[-1], lo), max(maxs[-1], hi)
+        return edges, mins, maxs
+
+    def cluster_polygon(self, s, e, base, edges, maxs):
+        """Returns the outline of the cluster [s, e) over the bins given by edges, filled down to base."""
+        j0 = np.searchsorted(edges, s, 'right') - 1
+        j1 = np.searchsorted(edges, e, 'left') - 1
+        xs = np.concatenate(([s], edges[j0 + 1:j1 + 1], [e]))
+        tops = maxs[j0:j1 + 1].copy()
+        if s > edges[j0] or j0 == j1:
+            tops[0] = self.range_extrema(s, min(e, edges[j0 + 1]))[1]
+        if e < edges[j1 + 1] and j1 > j0:
+            tops[-1] = self.range_extrema(edges[j1], e)[1]
+        top = np.column_stack((np.repeat(xs, 2)[1:-1], np.repeat(tops, 2)))
+        return np.vstack(([[s, base]], top, [[e, base]]))
+
+    def update(self, *args):
+        """Recomputes the envelope and cluster polygons for the visible range."""
+        if self.n == 0:
+            return
+        x0, x1 = sorted(self.ax.get_xlim())
+        a = int(np.clip(np.floor(x0), 0, self.n - 1))
+        b = int(np.clip(np.ceil(x1) + 1, a + 1, self.n))
+        width = max(1, int(self.ax.bbox.width))
+        edges, mins, maxs = self.envelope(a, b, width)
+
+        centres = np.repeat((edges[:-1] + edges[1:] - 1) / 2, 2)
+        self.line.set_data(centres, np.column_stack((mins, maxs)).ravel())
+        top = np.column_stack((np.repeat(edges, 2)[1:-1], np.repeat(maxs, 2)))
+        self.root.set_verts([np.vstack(([[a, 0]], top, [[edges[-1], 0]]))])
+
+        verts, colors = [], []
+        for i, (s, e) in enumerate(self.clusters):
+            s, e = max(s, a), min(e, b)
+            if s < e:
+                verts.append(self.cluster_polygon(s, e, self.clusters_min[i], edges, maxs))
+                colors.append(self.colors[i])
+        self.fills.set_verts(verts)
+        self.fills.set_facecolors(colors)
+
+
+class DensityMapRenderer:
+    """Draws a 2D scatter plot of many points onto a matplotlib axes as a density map at the resolution of the screen.
+
+    A 2D histogram of all the points is computed once over their full extent, at a resolution finer than the screen. The
+    map drawn is rebinned from it for the visible range, with about one bin per pixels_per_bin pixels, whenever the
+    limits or the size of the figure change, so that redrawing does not depend on the number of points. Only when the
+    view is zoomed in beyond the resolution of the precomputed histogram are the points inside the visible range binned
+    again. On a full-sphere projection such as aitoff, which cannot be zoomed, the histogram is of longitude and latitude
+    in radians and always covers the whole sphere.
+
+    Parameters
+    ---------
+    ax : 'matplotlib axes'
+            The axes to draw on.
+
+    x, y : 'numpy array'
+            The coordinates of the points. Non-finite points are left out.
+
+    bins : 'int'
+            The number of bins of the precomputed histogram along each axis.
+
+    full_sphere : 'bool'
+            Whether the axes use a full-sphere projection, in which case x and y are longitude and latitude in radians.
+    """
+    def __init__(self, ax, x, y, bins=1024, full_sphere=False, pixels_per_bin=2, cmap="Greys"):
+        self.ax = ax
+        self.full_sphere = full_sphere
+        self.pixels_per_bin = pixels_per_bin
+        self.cmap = cmap
+        self.mesh = None
+        self.set_data(x, y, bins)
+        self._xlim_cid = self._ylim_cid = self._resize_cid = None
+        if not full_sphere:
+            self._xlim_cid = ax.callbacks.connect('xlim_changed', self.update)
+            self._ylim_cid = ax.callbacks.connect('ylim_changed', self.update)
+            self._resize_cid = ax.figure.canvas.mpl_connect('resize_event', self.update)
+
+    def remove(self):
+        """Removes the density map from the axes and stops following their zoom."""
+        if self._xlim_cid is not None:
+            self.ax.callbacks.disconnect(self._xlim_cid)
+            self.ax.callbacks.disconnect(self._ylim_cid)
+            self.ax.figure.canvas.mpl_disconnect(self._resize_cid)
+        if self.mesh is not None:
+            self.mesh.remove()
+            self.mesh = None
+
+    def set_data(self, x, y, bins=None):
+        """Replaces the points and recomputes the precomputed histogram."""
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        finite = np.isfinite(x) & np.isfinite(y)
+        if not finite.all():
+            x, y = x[finite], y[finite]
+        self.x, self.y = x, y
+        bins = bins if bins is not None else self.base.shape[0]
+        if self.full_sphere:
+            extent = [[-np.pi, np.pi], [-np.pi / 2, np.pi / 2]]
+        elif len(x):
+            extent = [[x.min(), x.max()], [y.min(), y.max()]]
+        else:
+            extent = [[0, 1], [0, 1]]
+        self.base, self.xedges, self.yedges = np.histogram2d(x, y, bins, extent)
+
+    def visible_histogram(self, x0, x1, y0, y1, nx, ny):
+        """Returns a histogram of the points in [x0, x1] x [y0, y1] with about nx x ny bins, and its bin edges."""
+        i0 = max(np.searchsorted(self.xedges, x0, 'right') - 1, 0)
+        i1 = min(np.searchsorted(self.xedges, x1, 'left'), len(self.xedges) - 1)
+        j0 = max(np.searchsorted(self.yedges, y0, 'right') - 1, 0)
+        j1 = min(np.searchsorted(self.yedges, y1, 'left'), len(self.yedges) - 1)
+        if i1 - i0 >= nx and j1 - j0 >= ny:
+            xi = i0 + (np.arange(nx + 1) * (i1 - i0)) // nx
+            yj = j0 + (np.arange(ny + 1) * (j1 - j0)) // ny
+            counts = np.add.reduceat(self.base[i0:i1], xi[:-1] - i0, axis=0)
+            counts = np.add.reduceat(counts, yj[:-1] - j0, axis=1)
+            return counts, self.xedges[xi], self.yedges[yj]
+        inside = (self.x >= x0) & (self.x <= x1) & (self.y >= y0) & (self.y <= y1)
+        counts, xedges, yedges = np.histogram2d(self.x[inside], self.y[inside], (nx, ny), [[x0, x1], [y0, y1]])
+        return counts, xedges, yedges
+
+    def update(self, *args):
+        """Rebins the density map for the visible range and redraws it."""
+        from matplotlib.collections import QuadMesh
+        from matplotlib.colors import LogNorm
+
+        if self.full_sphere:
+            x0, x1, y0, y1 = -np.pi, np.pi, -np.pi / 2, np.pi / 2
+        else:
+            x0, x1 = sorted(self.ax.get_xlim())
+            y0, y1 = sorted(self.ax.get_ylim())
+        nx = max(1, int(self.ax.bbox.width / self.pixels_per_bin))
+        ny = max(1, int(self.ax.bbox.height / self.pixels_per_bin))
+        counts, xedges, yedges = self.visible_histogram(x0, x1, y0, y1, nx, ny)
+
+        if self.mesh is not None:
+            self.mesh.remove()
+        coords = np.stack(np.meshgrid(xedges, yedges), axis=-1)
+        self.mesh = QuadMesh(coords, cmap=self.cmap, norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)),
+                             zorder=0.5, edgecolors='none')
+        self.mesh.set_array(np.ma.masked_equal(counts.T, 0).ravel())
+        self.ax.add_collection(self.mesh, autolim=False)
@@ -0,0 +1,89 @@
+#The results of a headless AstroGlue run
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .cache import AstroLinkResult
+from .loaders import load_column, save_column
+
+ASTROLINK_ATTRS = ("logRho", "ordering", "clusters", "ids")
+
+
+def save_astrolink_list(path, astrolink_list):
+    """Saves the arrays AstroGlue reads from every AstroLink object of astrolink_list to the directory path, one .npy
+    file per array."""
+    for i, c in enumerate(astrolink_list):
+        for attr in ASTROLINK_ATTRS:
+            np.save(os.path.join(path, f"astrolink_{i}_{attr}.npy"), np.asarray(getattr(c, attr)))
+
+
+def load_astrolink_list(path, n_spaces, mmap_mode="r"):
+    """Returns the n_spaces AstroLinkResult objects saved to the directory path with save_astrolink_list(). By default
+    the arrays are memory-mapped rather than read into memory."""
+    return [AstroLinkResult(*(np.asarray(np.load(os.path.join(path, f"astrolink_{i}_{attr}.npy"), mmap_mode=mmap_mode))
+                              for attr in ASTROLINK_ATTRS))
+            for i in range(n_spaces)]
+
+
+class AstroGlueResults:
+    """The output of AstroGlue.compute(): the master table, the AstroLink result of every feature space and the plots
+    chosen for it. It can be saved to and loaded from a directory and passed to AstroGlue.visualize().
+
+    Parameters
+    ---------
+    master_df : 'pandas dataframe'
+            The raw data together with the ordered_index_* and log_rho_* columns of every feature space.
+
+    feature_space_name : 'list'
+            The names of the feature spaces, in the same order as astrolink_list.
+
+    astrolink_list : 'list'
+            The AstroLink objects (or AstroLinkResult objects) of the feature spaces.
+
+    var_plot_list : 'list'
+            A list of lists containing the column names to be plotted, corresponding to type_l.
+
+    type_l : 'list'
+            A list of the names of the type of plot to be made for each entry of var_plot_list.
+    """
+    def __init__(self, master_df, feature_space_name, astrolink_list, var_plot_list, type_l):
+        self.master_df = master_df
+        self.feature_space_name = list(feature_space_name)
+        self.astrolink_list = list(astrolink_list)
+        self.var_plot_list = var_plot_list
+        self.type_l = type_l
+        self.ord_ind_l = ["ordered_index_" + i for i in self.feature_space_name]
+        self.log_rho_l = ["log_rho_" + i for i in self.feature_space_name]
+
+    def save(self, path):
+        """Saves the results to the directory path: one .npy file per array (text columns as in save_column()) plus a
+        manifest.json."""
+        os.makedirs(path, exist_ok=True)
+        manifest = {"columns": [str(col) for col in self.master_df.columns],
+                    "dtypes": [str(dtype) for dtype in self.master_df.dtypes],
+                    "kinds": [],
+                    "feature_space_name": self.feature_space_name,
+                    "var_plot_list": self.var_plot_list,
+                    "type_l": self.type_l}
+        for i, col in enumerate(self.master_df.columns):
+            manifest["kinds"].append(save_column(os.path.join(path, f"column_{i}"), self.master_df.iloc[:, i]))
+        save_astrolink_list(path, self.astrolink_list)
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Loads results saved with save(). By default the arrays are memory-mapped rather than read into memory."""
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+
+        n = len(manifest["columns"])
+        # Results saved before text columns were supported only hold numeric columns
+        kinds = manifest.get("kinds", ["array"] * n)
+        dtypes = manifest.get("dtypes", [None] * n)
+        master_df = pd.DataFrame({col: load_column(os.path.join(path, f"column_{i}"), dtypes[i], kinds[i], mmap_mode)
+                                  for i, col in enumerate(manifest["columns"])}, copy=False)
+        astrolink_list = load_astrolink_list(path, len(manifest["feature_space_name"]), mmap_mode)
+        return cls(master_df, manifest["feature_space_name"], astrolink_list, manifest["var_plot_list"], manifest["type_l"])
@@ -0,0 +1,92 @@
+#Per-cluster summary statistics computed from the contiguous cluster ranges of the AstroLink ordering
+import functools
+
+import numpy as np
+import pandas as pd
+
+
+def prefix_sum(a):
+    """Returns the cumulative sum of a with a leading zero, so that the sum of a[s:e] is p[e] - p[s]."""
+    p = np.empty(len(a) + 1, dtype=np.float64)
+    p[0] = 0
+    np.cumsum(a, out=p[1:])
+    return p
+
+
+@functools.lru_cache(maxsize=None)
+def _segment_medians_njit():
+    """Returns the numba kernel of segment_medians(), compiled on first use so that importing AstroGlue does not import
+    numba."""
+    from numba import njit, prange
+
+    @njit(parallel=True, cache=True)
+    def segment_medians(xo, starts, ends):
+        medians = np.full(len(starts), np.nan)
+        for i in prange(len(starts)):
+            if ends[i] > starts[i]:
+                medians[i] = np.median(xo[starts[i]:ends[i]])
+        return medians
+
+    return segment_medians
+
+
+def segment_medians(xo, starts, ends):
+    """Returns the median of every range [starts[i], ends[i]) of xo, the ranges being processed in parallel."""
+    return _segment_medians_njit()(xo, starts, ends)
+
+
+def cluster_summary(c, columns, weights=None):
+    """Returns a dataframe of summary statistics of every cluster of the AstroLink result c, one row per cluster.
+
+    Every cluster is the contiguous range [start, end) of c.ordering, so each column is gathered into the ordered list
+    once and the sums over all clusters are differences of its prefix sums, with no per-cluster masks. Sums are taken
+    in float64 about the mean of the column, which keeps the variances accurate. Only the medians need a pass over
+    each cluster, which the clusters make in parallel.
+
+    Parameters
+    ---------
+    c : 'AstroLink object'
+            The AstroLink object (or AstroLinkResult object) whose clusters are summarised.
+
+    columns : 'dict'
+            Maps column names to 1D numeric arrays holding their values in input order.
+
+    weights : 'numpy array'
+            The mass of every point, in input order. If given, the total mass and the mass-weighted centroid of every
+            column are added.
+
+    Returns
+    ---------
+    summary : 'pandas dataframe'
+            The columns 'id', 'start', 'end' and 'count' ('mass'), then '<col> mean', '<col> std', '<col> median'
+            ('<col> centroid') for every column.
+    """
+    ordering = np.asarray(c.ordering)
+    clusters = np.asarray(c.clusters, dtype=np.int64)
+    starts, ends = clusters[:, 0], clusters[:, 1]
+    counts = ends - starts
+    out = {"id": np.asarray(c.ids).astype(str), "start": starts, "end": ends, "count": counts}
+    if weights is not None:
+        w = np.take(weights, ordering).astype(np.float64, copy=False)
+        pw = prefix_sum(w)
+        mass = pw[ends] - pw[starts]
+        out["mass"] = mass
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for name, x in columns.items():
+            xo = np.take(x, ordering).astype(np.float64, copy=False)
+            shift = xo.mean()
+            d = xo - shift
+            p1 = prefix_sum(d)
+            s1 = p1[ends] - p1[starts]
+            del p1
+            p2 = prefix_sum(d * d)
+            s2 = p2[ends] - p2[starts]
+            del p2
+            out[f"{name} mean"] = shift + s1 / counts
+            out[f"{name} std"] = np.sqrt(np.maximum(s2 - s1 * s1 / counts, 0) / counts)
+            out[f"{name} median"] = segment_medians(xo, starts, ends)
+            if weights is not None:
+                pwx = prefix_sum(w * d)
+                out[f"{name} centroid"] = shift + (pwx[ends] - pwx[starts]) / mass
+    return pd.DataFrame(out)
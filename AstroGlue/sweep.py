@@ -0,0 +1,149 @@
+#Parameter sweeps of AstroLink that share the stages common to several settings
+import copy
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from .cache import AstroLinkResult
+from .parallel import read_shared, shared_pool, split_cores
+
+#The order in which AstroLink's parameters are expanded into settings, from the most to the least expensive to vary
+SWEEP_PARAMS = ("adaptive", "k_den", "k_link", "S", "h_style")
+
+
+def expand_grid(base, grid):
+    """Returns the list of AstroLink keyword-argument dictionaries of a sweep: every combination of the values in grid,
+    which maps parameter names to lists of values, with the other parameters taken from base."""
+    names = [name for name in SWEEP_PARAMS if name in grid]
+    return [dict(base, **dict(zip(names, values))) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def summarize(c):
+    """Returns the comparison-table entries of a finished AstroLink run c."""
+    significances = np.asarray(c.significances)[1:]
+    sizes = np.diff(np.asarray(c.clusters)[1:], axis=1).ravel()
+    return {"S_used": float(c.S), "n_clusters": len(significances),
+            "max_significance": significances.max() if len(significances) else np.nan,
+            "median_significance": np.median(significances) if len(significances) else np.nan,
+            "largest_cluster": sizes.max() if len(sizes) else 0,
+            "clustered_fraction": np.count_nonzero(_clustered(c)) / c.n_samples}
+
+
+def _clustered(c):
+    """Returns the mask of the points of c that belong to at least one cluster besides the root."""
+    in_cluster = np.zeros(c.n_samples + 1, dtype=np.int64)
+    for s, e in np.asarray(c.clusters)[1:]:
+        in_cluster[s] += 1
+        in_cluster[e] -= 1
+    mask = np.empty(c.n_samples, dtype=bool)
+    mask[np.asarray(c.ordering)] = np.cumsum(in_cluster[:-1]) > 0
+    return mask
+
+
+def _downstream(base, logRho, kNN, k_link, finals):
+    """Runs the stages of AstroLink that follow the density estimate, for one k_link and every (S, h_style) pair of
+    finals, on a copy of base. Returns one (summary, AstroLinkResult) pair per entry of finals."""
+    c = copy.copy(base)
+    c.logRho = logRho
+    c.kNN = np.ascontiguousarray(kNN[:, :k_link])
+    c.k_link = k_link
+    c.aggregate()
+    c.compute_significances()
+    out = []
+    for S, h_style in finals:
+        f = copy.copy(c)
+        f.S, f.h_style = S, h_style
+        f.extract_clusters()
+        out.append((summarize(f), AstroLinkResult(f.logRho, f.ordering, f.clusters, np.asarray(f.ids))))
+    return out
+
+
+def _run_downstream_job(base, specs, k_link, finals):
+    """Runs _downstream() on the logRho and kNN arrays shared through specs. Executed in a pool worker."""
+    from numba import config, set_num_threads
+
+    set_num_threads(min(base.workers, config.NUMBA_NUM_THREADS))
+    logRho = read_shared(specs[0])
+    kNN = read_shared(specs[1], (slice(None), slice(None, k_link)))
+    return _downstream(base, logRho, kNN, k_link, finals)
+
+
+def _with_workers(params, n_cores):
+    """Returns params with workers=-1, which AstroLink does not accept, replaced by the whole core budget."""
+    if params.get("workers", -1) == -1:
+        params = dict(params, workers=split_cores(1, 1, n_cores)[1])
+    return params
+
+
+def sweep_astrolink(X, settings, n_jobs=1, n_cores=-1):
+    """Runs AstroLink on X with every setting of a parameter sweep, sharing the stages that several settings have in
+    common.
+
+    The transformation, neighbour search and density estimate only depend on adaptive and k_den, so they are run once
+    per distinct pair, keeping as many neighbours as the largest k_link of that pair needs. The aggregation and the
+    fit of the prominence model are then run once per k_link, and only the extraction of the clusters is run for every
+    (S, h_style) pair. If n_jobs is not 1, the runs of the different k_link values are spread over a process pool of
+    n_jobs processes, which take logRho and the neighbours from shared memory.
+
+    Parameters
+    ---------
+    X : 'numpy array'
+            The (n_samples, n_features) array of the feature space.
+
+    settings : 'list'
+            A list of dictionaries containing the AstroLink keyword arguments of each setting, e.g. from expand_grid().
+
+    n_jobs : 'int'
+            The maximum number of processes running the aggregation stages at the same time (-1 for one per k_link).
+
+    n_cores : 'int'
+            The total number of cores that can be used (-1 for all of them).
+
+    Returns
+    ---------
+    (table, astrolink_list) : 'tuple'
+            A dataframe with one row per setting, holding its parameters, the resolved k_link and S, the number of
+            clusters found, their largest and median significance, the size of the largest cluster and the fraction
+            of points in any cluster, and the AstroLinkResult of every setting in the same order.
+    """
+    from astrolink import AstroLink
+
+    rows = [None] * len(settings)
+    results = [None] * len(settings)
+    groups = {}
+    for j, params in enumerate(settings):
+        groups.setdefault((params.get("adaptive", 1), params.get("k_den", 20)), []).append(j)
+
+    for (adaptive, k_den), members in groups.items():
+        # AstroLink resolves k_link='auto' from k_den and the dimensionality
+        k_links = {}
+        for j in members:
+            k_links.setdefault(AstroLink(X, **_with_workers(settings[j], n_cores)).k_link, []).append(j)
+        base = AstroLink(X, **_with_workers(dict(settings[members[0]], k_link=max(k_links)), n_cores))
+        base.transform_data()
+        base.estimate_density_and_kNN()
+        logRho, kNN = base.logRho, base.kNN
+        base.P = base.logRho = base.kNN = None
+
+        jobs = [(k_link, members_k, [(settings[j].get("S", 'auto'), settings[j].get("h_style", 1)) for j in members_k])
+                for k_link, members_k in sorted(k_links.items())]
+        if n_jobs == 1 or len(jobs) == 1:
+            outputs = [_downstream(base, logRho, kNN, k_link, finals) for k_link, _, finals in jobs]
+        else:
+            outputs = _run_downstream_pool(base, logRho, kNN, jobs, n_jobs, n_cores)
+        for (k_link, members_k, _), output in zip(jobs, outputs):
+            for j, (summary, result) in zip(members_k, output):
+                rows[j] = dict({name: settings[j].get(name) for name in SWEEP_PARAMS}, k_link_used=k_link, **summary)
+                results[j] = result
+    return pd.DataFrame(rows), results
+
+
+def _run_downstream_pool(base, logRho, kNN, jobs, n_jobs, n_cores):
+    """Runs the jobs of sweep_astrolink() on a process pool, sharing logRho and kNN through shared memory."""
+    n_jobs, workers = split_cores(len(jobs), n_jobs, n_cores)
+    base = copy.copy(base)
+    base.workers = workers
+    with shared_pool([logRho, kNN], n_jobs) as (pool, specs):
+        pending = [pool.apply_async(_run_downstream_job, (base, specs, k_link, finals)) for k_link, _, finals in jobs]
+        return [job.get() for job in pending]
@@ -0,0 +1,249 @@
+"""Benchmarks of the stages of AstroGlue.run() on synthetic galaxy-like data.
+
+Every configuration (number of rows x number of feature spaces) is run through the public API, headless, with the
+Glue application and its viewers replaced by stubs so that only AstroGlue's own work is measured. Three calls are timed
+and memory-profiled as a whole:
+
+    set_variables   reading the input file into data_df and self.P
+    compute         compute(): compacting, running AstroLink on every feature space and building the master table
+    visualize       visualize(): building the Glue data, the ordered-density and the other viewers
+
+and the spans recorded by set_instrumentation() during them (e.g. "AstroLink pos", "data_prep", "viewer 1D Histogram")
+give the breakdown of each call.
+
+Results are written as JSON, and two result files (e.g. from two commits) can be compared:
+
+    python benchmarks/bench_pipeline.py --sizes 1e4 1e5 1e6 --spaces 1 3 6 --output new.json
+    python benchmarks/bench_pipeline.py --compare old.json new.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+from AstroGlue import AstroGlue
+from AstroGlue.instrument import PeakRSS
+
+FEATURE_SPACES = [
+    ("pos", ["x", "y", "z"]),
+    ("vel", ["vx", "vy", "vz"]),
+    ("posvel", ["x", "y", "z", "vx", "vy", "vz"]),
+    ("xy", ["x", "y"]),
+    ("vxvy", ["vx", "vy"]),
+    ("chem", ["Fe/H", "Alpha/Fe"]),
+]
+PLOTS = [(["x", "y", "z"], "3D Scatter Plot"), (["vx", "vy"], "2D Scatter Plot (rectilinear)"),
+         (["Fe/H"], "1D Histogram")]
+
+
+def make_galaxy(n_rows, n_clumps=50, clump_fraction=0.3, seed=0):
+    """Returns a dataframe of n_rows stars: a smooth halo plus n_clumps Gaussian clumps in position/velocity space, with
+    chemical abundances that differ from clump to clump."""
+    rng = np.random.default_rng(seed)
+    n_clumped = int(n_rows * clump_fraction)
+    clump = rng.integers(0, n_clumps, n_clumped)
+    pos_centres = rng.normal(0, 30, (n_clumps, 3))
+    vel_centres = rng.normal(0, 150, (n_clumps, 3))
+    pos_widths = rng.uniform(0.5, 3, n_clumps)
+    vel_widths = rng.uniform(5, 20, n_clumps)
+    pos = np.vstack((rng.standard_t(3, (n_rows - n_clumped, 3)) * 20,
+                     pos_centres[clump] + rng.normal(size=(n_clumped, 3)) * pos_widths[clump, None]))
+    vel = np.vstack((rng.normal(0, 120, (n_rows - n_clumped, 3)),
+                     vel_centres[clump] + rng.normal(size=(n_clumped, 3)) * vel_widths[clump, None]))
+    feh = np.concatenate((rng.normal(-1.5, 0.5, n_rows - n_clumped), rng.normal(-1, 0.2, n_clumps)[clump]))
+    alpha = np.concatenate((rng.normal(0.3, 0.1, n_rows - n_clumped), rng.normal(0.2, 0.05, n_clumps)[clump]))
+    data = np.column_stack((pos, vel, feh, alpha))[rng.permutation(n_rows)]
+    return pd.DataFrame(data, columns=["x", "y", "z", "vx", "vy", "vz", "Fe/H", "Alpha/Fe"])
+
+
+def measure(func):
+    """Runs func and returns its result together with its wall time, CPU time and peak RSS increase."""
+    gc.collect()
+    with PeakRSS() as mem:
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return result, {"wall_s": wall, "cpu_s": cpu, "peak_rss_mb": mem.delta / 2**20}
+
+
+def stub_glue():
+    """Replaces the Glue modules imported by AstroGlue.visualize() with stubs whose viewers draw onto Agg axes."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    class Component:
+        def __init__(self, values):
+            self.values = values
+
+        @staticmethod
+        def autotyped(values):
+            return values
+
+    class Data:
+        def __init__(self, label):
+            self.label = label
+            self.id = {}
+
+        def add_component(self, values, label):
+            self.id[label] = label
+
+    class DataCollection(dict):
+        def append(self, data):
+            self[data.label] = data
+
+    class Viewer:
+        def __init__(self):
+            self.state = types.SimpleNamespace(layers=[], using_full_sphere=False, using_degrees=False,
+                                               add_callback=lambda *args: None)
+            self.layers = []
+            self.figure, self.axes = plt.subplots()
+
+        def add_data(self, data):
+            pass
+
+    class GlueApplication:
+        def __init__(self, dc):
+            self.viewers = [[]]
+
+        def new_data_viewer(self, cls):
+            viewer = Viewer()
+            self.viewers[0].append(viewer)
+            return viewer
+
+        def gather_current_tab(self):
+            plt.close("all")
+
+    modules = {
+        "glue.core": {"DataCollection": DataCollection, "Data": Data},
+        "glue.core.component": {"Component": Component},
+        "glue.core.subset": {"Subset": type("Subset", (), {})},
+        "glue_qt.app.application": {"GlueApplication": GlueApplication},
+        "glue_qt.viewers.scatter": {"ScatterViewer": Viewer},
+        "glue_qt.viewers.histogram": {"HistogramViewer": Viewer},
+        "glue_vispy_viewers.scatter.scatter_viewer": {"VispyScatterViewer": Viewer},
+    }
+    for name, attrs in modules.items():
+        for i in range(1, name.count(".") + 2):
+            sys.modules.setdefault(".".join(name.split(".")[:i]), types.ModuleType(name))
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+
+def run_config(n_rows, n_spaces, fmt, workdir, k_den=20, compact=False):
+    """Runs the pipeline on one synthetic dataset and returns the measurements of each call and of each span."""
+    df = make_galaxy(n_rows)
+    file_path = os.path.join(workdir, f"galaxy_{n_rows}.{fmt}")
+    if fmt == "npy":
+        np.save(file_path, df.to_numpy())
+    else:
+        df.to_csv(file_path, index=False)
+    del df
+    spaces = FEATURE_SPACES[:n_spaces]
+
+    ag = AstroGlue()
+    ag.set_instrumentation()
+    ag.set_precision(compact)
+    stages = {}
+
+    def set_variables():
+        ag.set_variables(file_path, None, [fs for _, fs in spaces], [1] * n_spaces, [k_den] * n_spaces,
+                         ['auto'] * n_spaces, ['auto'] * n_spaces, [1] * n_spaces, [os.cpu_count()] * n_spaces, [0] * n_spaces,
+                         [name for name, _ in spaces], [p for p, _ in PLOTS], [t for _, t in PLOTS])
+        # .npy files have no header
+        ag.data_df.columns = make_galaxy(1).columns
+
+    _, stages["set_variables"] = measure(set_variables)
+    results, stages["compute"] = measure(ag.compute)
+    _, stages["visualize"] = measure(lambda: ag.visualize(results, start=False))
+    spans = [{"name": sp.name, "wall_s": sp.wall, "cpu_s": sp.cpu, "peak_rss_mb": sp.peak_rss / 2**20}
+             for sp in ag.tracer.spans]
+    return {"n_rows": n_rows, "n_spaces": n_spaces, "format": fmt, "compact": compact, "stages": stages, "spans": spans}
+
+
+def span_totals(spans):
+    """Returns the wall time and the largest peak RSS of the spans of each name, as a dict like the stages of a run."""
+    totals = {}
+    for sp in spans:
+        t = totals.setdefault(sp["name"], {"wall_s": 0.0, "peak_rss_mb": 0.0})
+        t["wall_s"] += sp["wall_s"]
+        t["peak_rss_mb"] = max(t["peak_rss_mb"], sp["peak_rss_mb"])
+    return totals
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_path, new_path):
+    """Prints the new/old ratio of the wall time and peak RSS of every call and span found in both result files."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_runs = {(r["n_rows"], r["n_spaces"], r["format"], r.get("compact", False)): {**r["stages"], **span_totals(r["spans"])}
+                for r in old["results"]}
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    print(f"{'rows':>10} {'spaces':>6} {'fmt':>4} {'stage':>36} {'wall old':>10} {'wall new':>10} {'ratio':>6} {'rss ratio':>9}")
+    for r in new["results"]:
+        key = (r["n_rows"], r["n_spaces"], r["format"], r.get("compact", False))
+        if key not in old_runs:
+            continue
+        for stage, m in {**r["stages"], **span_totals(r["spans"])}.items():
+            o = old_runs[key].get(stage)
+            if o is None:
+                continue
+            ratio = m["wall_s"] / o["wall_s"] if o["wall_s"] else float("nan")
+            rss_ratio = m["peak_rss_mb"] / o["peak_rss_mb"] if o["peak_rss_mb"] > 0 else float("nan")
+            print(f"{key[0]:>10} {key[1]:>6} {key[2]:>4} {stage:>36} {o['wall_s']:>10.3f} {m['wall_s']:>10.3f} {ratio:>6.2f} {rss_ratio:>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e4, 1e5], help="numbers of rows (1e4 to 1e7)")
+    parser.add_argument("--spaces", nargs="+", type=int, default=[1, 3, 6], help="numbers of feature spaces (1 to 6)")
+    parser.add_argument("--format", nargs="+", choices=["npy", "csv"], default=["npy"], help="input file formats")
+    parser.add_argument("--compact", action="store_true", help="store the data as float32/int32 (set_precision())")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    stub_glue()
+    output = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+              "cpu_count": os.cpu_count(), "results": []}
+    with tempfile.TemporaryDirectory() as workdir:
+        # Compile AstroLink's numba functions for every dimensionality and memory layout before timing anything
+        for fmt in args.format:
+            run_config(500, len(FEATURE_SPACES), fmt, workdir, compact=args.compact)
+        for n_rows in args.sizes:
+            for n_spaces in args.spaces:
+                for fmt in args.format:
+                    r = run_config(int(n_rows), n_spaces, fmt, workdir, compact=args.compact)
+                    output["results"].append(r)
+                    print(f"{r['n_rows']:>10} rows {n_spaces} spaces {fmt}: " +
+                          ", ".join(f"{k} {v['wall_s']:.2f}s/{v['peak_rss_mb']:.0f}MB" for k, v in r["stages"].items()),
+                          flush=True)
+                    with open(args.output, "w") as f:
+                        json.dump(output, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+STUB_DIR = os.path.join(os.path.dirname(__file__), "stub")
+# The streaming tests set up the Glue application without a display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+@pytest.fixture
+def astrolink_stub(monkeypatch):
+    """Replaces astrolink by the stub in tests/stub, in spawned worker processes too, and returns its AstroLink class.
+    AstroLink.calls holds the (P, params) of every instance made during the test."""
+    monkeypatch.syspath_prepend(STUB_DIR)
+    monkeypatch.delitem(sys.modules, "astrolink", raising=False)
+    import astrolink
+
+    astrolink.AstroLink.calls.clear()
+    yield astrolink.AstroLink
+    sys.modules.pop("astrolink", None)
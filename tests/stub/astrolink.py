@@ -0,0 +1,21 @@
+#Stand-in for the astrolink package in the tests, importable by spawned worker processes as well
+import numpy as np
+
+
+class AstroLink:
+    """Stands in for AstroLink, with results that only depend on the data: the points are ordered by the sum of their
+    coordinates, which is also their log-density. Every instance is recorded in calls as its (P, params)."""
+    calls = []
+
+    def __init__(self, P, **params):
+        AstroLink.calls.append((P, params))
+        self.P = P
+        self.params = params
+
+    def run(self):
+        n = len(self.P)
+        self.n_samples = n
+        self.logRho = np.asarray(self.P, dtype=np.float64).sum(axis=1)
+        self.ordering = np.argsort(-self.logRho, kind="stable").astype(np.uint32)
+        self.clusters = np.array([[0, n]], dtype=np.uint32)
+        self.ids = np.array(['1'])
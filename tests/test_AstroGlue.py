@@ -1,5 +1,935 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
 from AstroGlue import AstroGlue
+from AstroGlue.batch import load_config, parse_size, run_batch, run_file
+from AstroGlue.cache import ResultCache
+from AstroGlue.hierarchy import ClusterHierarchy
+from AstroGlue.lod import stratified_subsample
+from AstroGlue.loaders import (array_to_df, column_major, column_slice, load_csv, load_npy, preview_file, read_csv_columns,
+                               sidecar_path)
+from AstroGlue import parallel
+from AstroGlue.parallel import RunCancelled, split_cores
+from AstroGlue.rendering import DensityMapRenderer, OrderedDensityRenderer
+from AstroGlue.results import AstroGlueResults
+from AstroGlue.summary import cluster_summary
+from AstroGlue.sweep import expand_grid, summarize, sweep_astrolink
+
+
+def fake_astrolink(n, rng):
+    """Stands in for a finished AstroLink run, exposing only what AstroGlue reads from it."""
+    logRho = rng.random(n)
+    ordering = rng.permutation(n).astype(np.uint32)
+    return SimpleNamespace(n_samples=n, logRho=logRho, ordering=ordering,
+                           clusters=np.array([[0, n]], dtype=np.uint32), ids=np.array(['1']))
+
+
+def k_dens(astrolink_stub):
+    """Returns the k_den of every AstroLink object the stub made, in order."""
+    return [params["k_den"] for _, params in astrolink_stub.calls]
+
+
+def merge_data_prep(ag):
+    """The merge-based master table construction that data_prep replaced."""
+    transposed_indi_l = list(zip(*[list(ag.P[:, i]) for i in range(len(ag.data_df.columns))]))
+    master_list = []
+    for i, c in enumerate(ag.astrolink_list):
+        df1 = pd.DataFrame(list(zip(range(c.n_samples), c.logRho[c.ordering])), columns=[ag.ord_ind_l[i], ag.log_rho_l[i]])
+        df2 = pd.DataFrame(transposed_indi_l, columns=ag.data_df.columns)
+        df2[ag.ord_ind_l[i]] = c.ordering.argsort()
+        merged_df1 = pd.merge(df2, df1, on=ag.ord_ind_l[i], sort=False)
+        merged_df1["input order"] = merged_df1.index
+        master_list.append(merged_df1)
+    master_df = master_list[0]
+    for i in range(1, len(master_list)):
+        master_list[i] = master_list[i][["input order", ag.ord_ind_l[i], ag.log_rho_l[i]]]
+        master_df = pd.merge(master_df, master_list[i], on='input order', how='inner')
+    return master_df
 
 
 def test_AstroGlue():
     pass
+
+
+def test_import_is_lazy():
+    # Heavy and display-bound dependencies must only be imported by the stages that use them
+    heavy = ["astrolink", "numba", "scipy", "matplotlib", "tkinter", "webbrowser", "glue", "glue_qt", "glue_vispy_viewers",
+             "PyQt5", "vispy"]
+    code = "import sys, AstroGlue; print(' '.join(m for m in %r if m in sys.modules))" % heavy
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
+
+    # Import-time budget for AstroGlue's own modules, excluding numpy and pandas (self times in microseconds)
+    own_us = 0
+    for line in out.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_us, _, name = line[len("import time:"):].split("|")
+            if name.strip().split(".")[0] == "AstroGlue":
+                own_us += int(self_us)
+    assert own_us < 250000
+
+
+def test_data_prep_matches_merge():
+    rng = np.random.default_rng(0)
+    n = 500
+    ag = AstroGlue()
+    ag.P = rng.normal(size=(n, 4))
+    ag.data_df = pd.DataFrame(ag.P, columns=["x", "y", "vx", "vy"])
+    ag.feature_space_name = ["pos", "vel", "posvel"]
+    ag.astrolink_list = [fake_astrolink(n, rng) for _ in ag.feature_space_name]
+    ag.ord_ind_l = ["ordered_index_" + i for i in ag.feature_space_name]
+    ag.log_rho_l = ["log_rho_" + i for i in ag.feature_space_name]
+
+    pd.testing.assert_frame_equal(ag.data_prep(), merge_data_prep(ag))
+
+
+def test_data_prep_text_columns(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame(rng.normal(size=(n, 2)), columns=["x", "y"])
+    df["name"] = ["star %d" % i for i in range(n)]
+    df["n"] = np.arange(n)
+    path = str(tmp_path / "data.csv")
+    df.to_csv(path, index=False)
+    ag = AstroGlue()
+    ag.set_variables(path, None, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"], [], [])
+    ag.run_astrolink = lambda: ag.astrolink_list.append(fake_astrolink(n, rng))
+    master_df = ag.compute().master_df
+    # The numeric columns keep their dtypes next to the text column
+    assert master_df["x"].dtype == np.float64 and master_df["n"].dtype == np.int64
+    pd.testing.assert_frame_equal(master_df, merge_data_prep(ag))
+
+
+def test_glue_data_text_columns(tmp_path):
+    from glue.core.component import CategoricalComponent, Component
+    from glue.core.subset import RangeSubsetState
+
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame(rng.normal(size=(n, 2)), columns=["x", "y"])
+    df["name"] = ["star %d" % i for i in range(n)]
+    path = str(tmp_path / "data.csv")
+    df.to_csv(path, index=False)
+    ag = AstroGlue()
+    ag.set_variables(path, None, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"], [], [])
+    ag.run_astrolink = lambda: ag.astrolink_list.append(fake_astrolink(n, rng))
+    data = ag.make_glue_data(ag.compute().master_df, "dataframe")
+    # Only the text column is categorical, so the numeric ones can still be range-selected
+    assert isinstance(data.get_component("name"), CategoricalComponent)
+    for col in ("x", "y", "ordered_index_pos", "log_rho_pos"):
+        assert type(data.get_component(col)) is Component
+    mask = data.get_mask(RangeSubsetState(0, 1, data.id["x"]))
+    np.testing.assert_array_equal(mask, (df["x"] >= 0) & (df["x"] <= 1))
+
+    # Numbers in an object array are numeric as well
+    data = ag.make_glue_data(pd.DataFrame({"x": np.array([1, 2.5, np.nan], dtype=object)}), "objects")
+    assert type(data.get_component("x")) is Component and data["x"].dtype == np.float64
+
+
+def test_single_copy_of_columns():
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({"x": rng.normal(size=n), "n": np.arange(n)})
+    P = column_major(df)
+    assert P.flags["F_CONTIGUOUS"] and P.dtype == float
+    np.testing.assert_array_equal(P, df.to_numpy())
+
+    ag = AstroGlue()
+    ag.P = P
+    ag.data_df = array_to_df(P, df.columns)
+    ag.feature_space_name = ["pos"]
+    ag.astrolink_list = [fake_astrolink(n, rng)]
+    ag.ord_ind_l, ag.log_rho_l = ["ordered_index_pos"], ["log_rho_pos"]
+    master_df = ag.data_prep()
+    data = ag.make_glue_data(master_df, "dataframe")
+    for j, col in enumerate(df.columns):
+        assert np.shares_memory(data[col], P[:, j])
+    assert np.shares_memory(data["log_rho_pos"], ag.astrolink_list[0].logRho)
+
+
+def test_linked_datasets():
+    from glue.core import DataCollection
+    from glue.core.subset import RangeSubsetState
+
+    rng = np.random.default_rng(0)
+    n = 300
+    data_df = pd.DataFrame(rng.normal(size=(n, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    ag.set_linked_datasets()
+    ag.set_variables("data.csv", data_df, [["x", "y"], ["z"]], [1, 1], [20, 20], ['auto'] * 2, ['auto'] * 2, [1, 1],
+                     [1, 1], [0, 0], ["pos", "z"], [], [])
+    ag.run_astrolink = lambda: ag.astrolink_list.extend(fake_astrolink(n, rng) for _ in ag.feature_spaces)
+    ag.compute()
+    ag.dc = DataCollection([ag.make_glue_data(ag.raw_table(), "dataframe")])
+    ag.update_glue_datasets()
+    full, pos = ag.dc["dataframe"], ag.dc["feature space pos"]
+    assert ag.dc.labels == ["dataframe", "feature space pos", "feature space z"]
+    assert [cid.label for cid in full.main_components] == ["x", "y", "z", "input order"]
+    assert np.shares_memory(full["x"], ag.P[:, 0]) and np.shares_memory(pos["input order"], full["input order"])
+
+    # A selection in the ordered-density plot of one feature space reaches the data and the other feature space
+    group = ag.dc.new_subset_group("first", RangeSubsetState(0, 9, pos.id["ordered_index_pos"]))
+    expected = np.isin(np.arange(n), ag.astrolink_list[0].ordering[:10])
+    for subset in group.subsets:
+        np.testing.assert_array_equal(subset.to_mask(), expected)
+
+    ag.set_variables("data.csv", ag.data_df, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"], [],
+                     [])
+    ag.compute()
+    ag.update_glue_datasets()
+    assert ag.dc.labels == ["dataframe", "feature space pos"]
+    # The join of the removed dataset is taken down with it
+    assert [(link.data1, link.data2) for link in ag.dc.external_links] == [(full, pos)]
+
+
+def test_split_cores():
+    assert split_cores(4, n_jobs=-1, n_cores=64) == (4, 16)
+    assert split_cores(4, n_jobs=2, n_cores=64) == (2, 32)
+    assert split_cores(8, n_jobs=-1, n_cores=4) == (4, 1)
+    assert split_cores(1, n_jobs=-1, n_cores=3) == (1, 3)
+
+
+def test_astrolink_pool(astrolink_stub, monkeypatch):
+    created = []
+
+    class RecordedSharedMemory(parallel.shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.name)
+
+    monkeypatch.setattr(parallel.shared_memory, "SharedMemory", RecordedSharedMemory)
+    data_df = pd.DataFrame(np.random.default_rng(0).normal(size=(200, 3)), columns=["x", "y", "z"])
+    master = []
+    for n_jobs in (1, 2):
+        ag = AstroGlue()
+        ag.set_variables("data.csv", data_df, [["x", "y"], ["z"], ["x", "y", "z"]], [1] * 3, [20] * 3, ['auto'] * 3,
+                         ['auto'] * 3, [1] * 3, [-1] * 3, [0] * 3, ["pos", "z", "all"], [], [])
+        ag.set_parallel(n_jobs=n_jobs, n_cores=2)
+        master.append(ag.compute().master_df)
+    # The pool returns the results in the order of the feature spaces, the same as the serial run
+    pd.testing.assert_frame_equal(master[1], master[0])
+    # Only the serial run clustered in this process
+    assert len(astrolink_stub.calls) == 3 and len(created) == 1
+    with pytest.raises(FileNotFoundError):
+        parallel.shared_memory.SharedMemory(name=created[0])
+
+
+def test_result_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    P = rng.normal(size=(100, 3))
+    params = dict(adaptive=1, k_den=20, S='auto', k_link='auto', h_style=1, workers=-1, verbose=0)
+    cache = ResultCache(str(tmp_path))
+    key = cache.key(P, [0, 1], params)
+    assert key == cache.key(P.copy(), [0, 1], dict(params, workers=4))
+    assert key != cache.key(P, [0, 2], params)
+    assert key != cache.key(P, [0, 1], dict(params, k_den=10))
+    assert cache.get(key) is None
+
+    c = fake_astrolink(100, rng)
+    c.ids = np.array(['1', '1-1'])
+    cache.put(key, c)
+    hit = cache.get(key)
+    assert hit.n_samples == 100 and list(hit.ids) == ['1', '1-1']
+    np.testing.assert_array_equal(hit.ordering, c.ordering)
+    np.testing.assert_array_equal(hit.logRho, c.logRho)
+
+    # Only the most recently stored result fits once the budget is one file
+    cache.max_bytes = (tmp_path / (key + ".npz")).stat().st_size
+    cache.put("other", fake_astrolink(100, rng))
+    assert cache.get(key) is None and cache.get("other") is not None
+
+
+def test_npy_single_buffer(tmp_path):
+    path = str(tmp_path / "data.npy")
+    np.save(path, np.arange(40.).reshape(10, 4))
+    P = load_npy(path)
+    data_df = array_to_df(P)
+    assert list(data_df.columns) == ["col1", "col2", "col3", "col4"]
+    assert np.shares_memory(data_df.to_numpy(), P)
+    assert np.shares_memory(column_slice(P, [1, 2, 3]), P)
+    assert not np.shares_memory(column_slice(P, [0, 2]), P)
+    np.testing.assert_array_equal(column_slice(P, [0, 2]), P[:, [0, 2]])
+
+
+def test_csv_sidecar(tmp_path):
+    path = str(tmp_path / "data.csv")
+    pd.DataFrame({"x": [1.5, 2.5, np.nan], "n": [1, 2, 3], "name": ["a", None, "c"]}).to_csv(path, index=False)
+    first = load_csv(path)
+    assert os.path.isdir(sidecar_path(path))
+    second = load_csv(path)
+    pd.testing.assert_frame_equal(second, first)
+    pd.testing.assert_frame_equal(second, pd.read_csv(path))
+
+    # A changed source file is parsed again rather than served from the stale sidecar
+    pd.DataFrame({"x": [0.5]}).to_csv(path, index=False)
+    os.utime(path, ns=(0, 0))
+    pd.testing.assert_frame_equal(load_csv(path), pd.read_csv(path))
+
+
+def test_ordered_density_envelope():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    rng = np.random.default_rng(0)
+    n = 100000
+    y = rng.random(n)
+    clusters = np.array([[0, n], [1000, 60000], [2001, 2004]])
+    fig, ax = plt.subplots()
+    ax.set_xlim(0, n)
+    r = OrderedDensityRenderer(ax, y, clusters, ["C0", "C1"])
+    for _ in range(100):
+        s = rng.integers(0, n)
+        e = rng.integers(s + 1, n + 1)
+        assert r.range_extrema(s, e) == (y[s:e].min(), y[s:e].max())
+
+    # Vertices are bounded by the width of the axes, and a sub-pixel cluster keeps its exact height
+    r.update()
+    assert len(r.line.get_xdata()) <= 2 * ax.bbox.width
+    narrow = r.fills.get_paths()[1].vertices
+    assert narrow[:, 1].max() == y[2001:2004].max()
+    assert narrow[:, 1].min() == y[2001:2004].min()
+
+    # Zooming in recomputes the envelope at full resolution
+    ax.set_xlim(500, 600)
+    np.testing.assert_array_equal(r.line.get_ydata()[::2], y[500:601])
+    plt.close(fig)
+
+
+def test_density_map():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(size=(2, 200000))
+    fig, ax = plt.subplots()
+    ax.set_xlim(x.min(), x.max())
+    ax.set_ylim(y.min(), y.max())
+    r = DensityMapRenderer(ax, x, y, bins=512)
+    r.update()
+    # Rebinned from the precomputed histogram, with one bin per two pixels at most
+    assert r.mesh.get_array().sum() == len(x)
+    assert r.mesh.get_array().size <= ax.bbox.width * ax.bbox.height / 4
+
+    # Zooming in beyond the precomputed histogram bins the visible points again
+    ax.set_xlim(0, 0.01)
+    ax.set_ylim(0, 0.01)
+    inside = (x >= 0) & (x <= 0.01) & (y >= 0) & (y <= 0.01)
+    assert r.mesh.get_array().sum() == inside.sum()
+
+    # Once removed, it no longer follows the zoom
+    r.remove()
+    ax.set_xlim(0, 1)
+    assert r.mesh is None and len(ax.collections) == 0
+    plt.close(fig)
+
+
+def test_density_map_rerun(astrolink_stub):
+    from matplotlib.collections import QuadMesh
+
+    data_df = pd.DataFrame(np.random.default_rng(0).normal(size=(500, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    ag.set_density_maps(min_rows=100, bins=64)
+
+    def set_spaces(feature_spaces, names):
+        m = len(names)
+        ag.set_variables("data.csv", data_df, feature_spaces, [1] * m, [20] * m, ['auto'] * m, ['auto'] * m, [1] * m,
+                         [1] * m, [0] * m, names, [["x", "y"]], ["2D Scatter Plot (rectilinear)"])
+
+    set_spaces([["x", "y"]], ["pos"])
+    ag.visualize(ag.compute(), start=False)
+    [(scatter, _, _, old)] = ag.density_map_renderers
+    set_spaces([["x", "y"], ["z"]], ["pos", "z"])
+    ag.rerun()
+    # The density map is drawn again on the same viewer, and the old one no longer follows the zoom
+    [(viewer, x, y, renderer)] = ag.density_map_renderers
+    assert viewer is scatter and (x, y) == ("x", "y") and renderer is not old and old.mesh is None
+    scatter.axes.set_xlim(0, 1)
+    assert [c for c in scatter.axes.collections if isinstance(c, QuadMesh)] == [renderer.mesh]
+
+
+def test_stratified_subsample():
+    rng = np.random.default_rng(0)
+    n = 100000
+    c = SimpleNamespace(ordering=rng.permutation(n), clusters=np.array([[0, n], [10, 13], [500, 60500], [70000, 70050]]))
+    ind = stratified_subsample(n, 5000, [c], min_cluster_points=20)
+    assert len(ind) == 5000 and len(np.unique(ind)) == 5000
+    assert np.all(np.diff(ind) > 0)
+    members = np.isin(c.ordering, ind)
+    assert members[10:13].all()
+    assert members[70000:70050].sum() >= 20
+    # The big cluster keeps roughly its share of the subsample
+    assert abs(members[500:60500].sum() / 5000 - 0.6) < 0.05
+    np.testing.assert_array_equal(stratified_subsample(n, 5000, [c], min_cluster_points=20), ind)
+    np.testing.assert_array_equal(stratified_subsample(100, 5000, [c]), np.arange(100))
+
+
+def test_csv_projection(astrolink_stub, tmp_path):
+    rng = np.random.default_rng(0)
+    n = 1200
+    df = pd.DataFrame(rng.normal(size=(n, 5)), columns=["a", "b", "c", "d", "e"])
+    df["n"] = np.arange(n)
+    # Numeric in the rows the dtypes are guessed from, but not further down
+    df["late"] = [str(i) for i in range(n - 1)] + ["x"]
+    path = str(tmp_path / "data.csv")
+    df.to_csv(path, index=False)
+
+    ag = AstroGlue()
+    ag.set_precision()
+    ag.set_projection()
+    ag.set_variables(path, None, [["a", "b"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"], [["c", "a"]],
+                     ["2D Scatter Plot (rectilinear)"])
+    assert ag.data_df is None
+    results = ag.compute()
+    assert list(ag.data_df.columns) == ["a", "b", "c"] and ag.P.dtype == np.float32
+    assert ag.file_columns == list(df.columns) and not os.path.exists(sidecar_path(path))
+    np.testing.assert_allclose(results.master_df["c"], df["c"], rtol=1e-6)
+
+    # Columns left out are read when asked for, after the loaded ones, so the clustering is kept
+    master = ag.master_df
+    ag.load_columns(["n", "ordered_index_pos", "a"])
+    assert list(ag.data_df.columns) == ["a", "b", "c", "n"]
+    np.testing.assert_array_equal(ag.master_df["n"], df["n"])
+    np.testing.assert_array_equal(ag.master_df["ordered_index_pos"], master["ordered_index_pos"])
+    ag.compute()
+    assert k_dens(astrolink_stub) == [20] and ag.changed_spaces == []
+
+    assert read_csv_columns(path, ["late", "e"], compact=True)["late"].iloc[-1] == "x"
+
+
+def test_csv_projection_renamed(astrolink_stub, tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(300, 4)), columns=["a", "b", "c", "d"])
+    path = str(tmp_path / "data.csv")
+    df.to_csv(path, index=False)
+
+    ag = AstroGlue()
+    ag.set_projection()
+    ag.set_variables(path, None, [["ra", "b"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"], [], [])
+    # What the input window sets when "a" and "d" were renamed before the file was read
+    ag.renamed_columns = {"ra": "a", "dec": "d"}
+    ag.compute()
+    assert list(ag.data_df.columns) == ["ra", "b"] and ag.file_columns == ["ra", "b", "c", "dec"]
+    np.testing.assert_allclose(ag.P, df[["a", "b"]].to_numpy())
+    ag.load_columns(["dec"])
+    np.testing.assert_allclose(ag.master_df["dec"], df["d"])
+
+    ag.save_session(str(tmp_path / "session"))
+    restored = AstroGlue()
+    restored.load_session(str(tmp_path / "session"))
+    assert list(restored.data_df.columns) == ["ra", "b", "dec"] and restored.renamed_columns == ag.renamed_columns
+    np.testing.assert_allclose(restored.data_df["dec"], df["d"])
+
+
+def test_compute_headless(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 300
+    data_df = pd.DataFrame(rng.normal(size=(n, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    ag.set_variables("data.csv", data_df, [["x", "y"], ["z"]], [1, 1], [20, 20], ['auto', 'auto'], ['auto', 'auto'],
+                     [1, 1], [-1, -1], [0, 0], ["pos", "z"], [["x", "y"]], ["2D Scatter Plot (rectilinear)"])
+    ag.run_astrolink = lambda: ag.astrolink_list.extend(fake_astrolink(n, rng) for _ in range(2))
+    results = ag.compute()
+    assert list(results.master_df.columns[-3:]) == ["input order", "ordered_index_z", "log_rho_z"]
+
+    results.save(str(tmp_path / "results"))
+    loaded = AstroGlueResults.load(str(tmp_path / "results"))
+    pd.testing.assert_frame_equal(loaded.master_df, results.master_df)
+    assert loaded.type_l == results.type_l and loaded.var_plot_list == results.var_plot_list
+    for a, b in zip(loaded.astrolink_list, results.astrolink_list):
+        np.testing.assert_array_equal(a.ordering, b.ordering)
+        assert a.n_samples == b.n_samples
+
+
+def test_results_text_columns(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 300
+    data_df = pd.DataFrame(rng.normal(size=(n, 2)), columns=["x", "y"])
+    data_df["name"] = pd.Series(["star %d" % i for i in range(n)], dtype=object)
+    data_df.loc[5, "name"] = np.nan
+    data_df["kind"] = pd.Series(np.where(np.arange(n) % 2, "disc", "halo"), dtype="str")
+    ag = AstroGlue()
+    ag.set_variables("data.csv", data_df, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"], [], [])
+    ag.run_astrolink = lambda: ag.astrolink_list.append(fake_astrolink(n, rng))
+    results = ag.compute()
+    results.save(str(tmp_path / "results"))
+    loaded = AstroGlueResults.load(str(tmp_path / "results"))
+    pd.testing.assert_frame_equal(loaded.master_df, results.master_df)
+
+
+def test_session(astrolink_stub, tmp_path):
+    file_path = str(tmp_path / "data.npy")
+    np.save(file_path, np.random.default_rng(0).normal(size=(300, 3)))
+    ag = AstroGlue()
+    ag.set_variables(file_path, None, [], [], [], [], [], [], [], [], [], [], [])
+    ag.data_df.columns = ["x", "y", "z"]
+    ag.set_variables(file_path, ag.data_df, [["x", "y"], ["z"]], [1, 1], [20, 30], ['auto'] * 2, ['auto'] * 2, [1, 1],
+                     [1, 1], [0, 0], ["pos", "z"], [["x", "y"]], ["2D Scatter Plot (rectilinear)"])
+    results = ag.compute()
+    ag.save_session(str(tmp_path / "session"))
+
+    restored = AstroGlue()
+    loaded = restored.load_session(str(tmp_path / "session"))
+    pd.testing.assert_frame_equal(loaded.master_df, results.master_df)
+    assert restored.k_den_list == [20, 30] and loaded.type_l == results.type_l
+    # The arrays are memory-mapped, not read
+    assert not restored.astrolink_list[0].ordering.flags.owndata and not restored.P.flags.owndata
+
+    # Only the edited feature space is clustered again
+    restored.k_den_list = [20, 40]
+    restored.rerun()
+    assert k_dens(astrolink_stub) == [20, 30, 40] and restored.changed_spaces == ["z"]
+
+    np.save(file_path, np.zeros((300, 3)))
+    with pytest.raises(ValueError):
+        AstroGlue().load_session(str(tmp_path / "session"))
+
+
+def test_preview(astrolink_stub):
+    rng = np.random.default_rng(0)
+    n = 1000
+    data_df = pd.DataFrame(rng.normal(size=(n, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    ag.set_variables("data.csv", data_df, [["x", "z"], ["y"]], [1, 1], [20, 20], ['auto'] * 2, ['auto'] * 2, [1, 1],
+                     [1, 1], [0, 0], ["xz", "y"], [], [])
+    ind = stratified_subsample(n, 100, [])
+    done = []
+    results = ag.preview(ind, lambda i, c: done.append(i))
+    assert done == [0, 1] and [c.n_samples for c in results] == [100, 100]
+    np.testing.assert_array_equal(astrolink_stub.calls[0][0], data_df[["x", "z"]].to_numpy()[ind])
+    assert ag.astrolink_list == [] and ag.master_df is None
+
+
+def poll_until_done(ag):
+    """Calls poll_stream() the way the Qt timer of visualize_streaming() does until the background run has finished."""
+    while ag.stream_timer is not None and ag.poll_stream():
+        time.sleep(0.01)
+
+
+def test_level_of_detail_streaming():
+    rng = np.random.default_rng(0)
+    n = 2000
+    data_df = pd.DataFrame(rng.normal(size=(n, 3)), columns=["x", "y", "z"])
+    c = fake_astrolink(n, rng)
+    # Eight small clusters, which a uniform subsample mostly misses
+    c.clusters = np.array([[0, n]] + [[10 * k, 10 * k + 10] for k in range(8)], dtype=np.uint32)
+    clustered = np.sort(c.ordering[:80])
+    for max_points, replaced in ((200, False), (50, True)):
+        ag = AstroGlue()
+        ag.set_level_of_detail(max_points, min_cluster_points=10)
+        ag.set_variables("data.csv", data_df, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"],
+                         [["x", "y", "z"]], ["3D Scatter Plot"])
+        ag.run_astrolink = lambda: ag.astrolink_list.append(c)
+        ag.visualize_streaming(start=False)
+        # Drawn before the clusters are known
+        old = ag.level_of_detail
+        viewer = old.viewers[0]
+        assert len(old.indices) == max_points and not np.isin(clustered, old.indices).all()
+        poll_until_done(ag)
+
+        lod = ag.level_of_detail
+        assert np.isin(clustered, lod.indices).all() and len(lod.indices) == max(max_points, 80)
+        assert (lod is not old) == replaced and lod.viewers == [viewer]
+        np.testing.assert_array_equal(lod.lod["input order"], lod.indices)
+        np.testing.assert_array_equal(lod.lod["x"], data_df["x"].to_numpy()[lod.indices])
+        assert [data.label for data in ag.dc].count("dataframe (decimated)") == 1
+        assert viewer.state.x_att is lod.lod.id["x"] and any(layer.layer is lod.lod for layer in viewer.layers)
+        # The links of a replaced decimated dataset are taken down with it
+        assert sum(lod.lod in (link.data1, link.data2) for link in ag.dc.external_links) == 4
+        if replaced:
+            assert all(old.lod not in (link.data1, link.data2) for link in ag.dc.external_links)
+
+
+def streaming_inputs(ag, data_df):
+    ag.set_variables("data.csv", data_df, [["x", "y"], ["z"], ["x", "y", "z"]], [1] * 3, [20] * 3, ['auto'] * 3,
+                     ['auto'] * 3, [1] * 3, [1] * 3, [0] * 3, ["pos", "z", "all"], [["x", "y"]],
+                     ["2D Scatter Plot (rectilinear)"])
+
+
+def test_visualize_streaming(astrolink_stub, monkeypatch):
+    data_df = pd.DataFrame(np.random.default_rng(0).normal(size=(500, 3)), columns=["x", "y", "z"])
+    # Every AstroLink run waits for the test to let it through
+    gate = threading.Semaphore(0)
+    run = astrolink_stub.run
+
+    def gated_run(self):
+        assert gate.acquire(timeout=10)
+        run(self)
+
+    monkeypatch.setattr(astrolink_stub, "run", gated_run)
+    ag = AstroGlue()
+    streaming_inputs(ag, data_df)
+    ag.visualize_streaming(start=False)
+    assert ag.ordered_density_viewers == {} and len(ag.ga.viewers[0]) == 1
+    names = ["pos", "z", "all"]
+    for k in range(len(names)):
+        assert list(ag.ordered_density_viewers) == names[:k]
+        gate.release()
+        for _ in range(1000):
+            if not ag.poll_stream() or len(ag.ordered_density_viewers) > k:
+                break
+            time.sleep(0.01)
+        # The viewer of a feature space is added as soon as it is clustered, with its columns
+        assert list(ag.ordered_density_viewers) == names[:k + 1]
+        assert "ordered_index_" + names[k] in [cid.label for cid in ag.dc["dataframe"].main_components]
+    poll_until_done(ag)
+
+    # The same dataset as when Glueviz is opened after the run
+    monkeypatch.setattr(astrolink_stub, "run", run)
+    expected = AstroGlue()
+    streaming_inputs(expected, data_df)
+    expected.visualize(expected.compute(), start=False)
+    full, expected_full = ag.dc["dataframe"], expected.dc["dataframe"]
+    labels = [cid.label for cid in expected_full.main_components]
+    assert sorted(cid.label for cid in full.main_components) == sorted(labels)
+    for label in labels:
+        np.testing.assert_array_equal(full[label], expected_full[label])
+    assert list(ag.ordered_density_viewers) == list(expected.ordered_density_viewers)
+    assert ag.cancel_event is None and ag.stream_timer is None
+
+
+def test_stream_preview_replaced_in_place(astrolink_stub):
+    data_df = pd.DataFrame(np.random.default_rng(0).normal(size=(500, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    streaming_inputs(ag, data_df)
+    # The whole dataset is only clustered once the previews are shown
+    previews_shown = threading.Event()
+    compute = ag.compute
+
+    def compute_after_previews():
+        assert previews_shown.wait(10)
+        return compute()
+
+    ag.compute = compute_after_previews
+    ag.visualize_streaming(start=False, preview_points=100)
+    for _ in range(1000):
+        ag.poll_stream()
+        if len(ag.ordered_density_viewers) == 3:
+            break
+        time.sleep(0.01)
+    assert ag.preview_spaces == {"pos", "z", "all"}
+    previews = dict(ag.ordered_density_viewers)
+    assert previews["pos"][0].axes.get_title() == ag.ordered_density_title(0, 100)
+    previews_shown.set()
+    poll_until_done(ag)
+
+    # The viewers showing the previews now show the whole dataset, with a new renderer
+    assert ag.preview_spaces == set()
+    for i, (name, (viewer, renderer)) in enumerate(ag.ordered_density_viewers.items()):
+        assert viewer is previews[name][0] and renderer is not previews[name][1]
+        assert viewer.axes.get_title() == ag.ordered_density_title(i)
+    assert np.isfinite(ag.dc["dataframe"]["ordered_index_pos"]).all()
+    assert len(ag.ga.viewers[0]) == 4
+
+
+def test_level_of_detail_compact(astrolink_stub):
+    data_df = pd.DataFrame(np.random.default_rng(0).normal(size=(2000, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    ag.set_precision()
+    ag.set_level_of_detail(500)
+    ag.set_variables("data.csv", data_df, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [1], [0], ["pos"],
+                     [["x", "y", "z"]], ["3D Scatter Plot"])
+    # Streaming adds the input order to the Glue data before the master table has it
+    ag.visualize_streaming(start=False)
+    assert ag.dc["dataframe"]["input order"].dtype == ag.level_of_detail.lod["input order"].dtype == np.int32
+    poll_until_done(ag)
+    assert ag.master_df["input order"].dtype == ag.dc["dataframe"]["input order"].dtype == np.int32
+    assert ag.level_of_detail.lod["input order"].dtype == np.int32
+
+
+def test_cancel_stream_keeps_previews(astrolink_stub):
+    rng = np.random.default_rng(0)
+    data_df = pd.DataFrame(rng.normal(size=(500, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    ag.set_variables("data.csv", data_df, [["x", "z"], ["y"]], [1, 1], [20, 20], ['auto'] * 2, ['auto'] * 2, [1, 1],
+                     [1, 1], [0, 0], ["xz", "y"], [], [])
+    # The whole dataset is only clustered once the run was cancelled, after the previews were queued
+    previews_done = threading.Event()
+    compute = ag.compute
+
+    def compute_after_cancel():
+        previews_done.set()
+        ag.cancel_event.wait(10)
+        return compute()
+
+    ag.compute = compute_after_cancel
+    ag.visualize_streaming(start=False, preview_points=100)
+    assert previews_done.wait(10)
+    ag.cancel_stream()
+    poll_until_done(ag)
+    # The previews computed before the cancellation are still shown
+    assert list(ag.ordered_density_viewers) == ["xz", "y"] and ag.preview_spaces == {"xz", "y"}
+    assert ag.astrolink_list == [] and ag.cancel_event is None
+    assert np.isfinite(ag.dc["dataframe"]["ordered_index_xz"]).sum() == 100
+
+
+def test_sweep_grid():
+    settings = expand_grid({"k_den": 20, "S": 'auto', "k_link": 'auto', "workers": 1}, {"S": [2, 3], "k_den": [20, 30]})
+    # Settings sharing a density estimate are next to each other
+    assert [(p["k_den"], p["S"]) for p in settings] == [(20, 2), (20, 3), (30, 2), (30, 3)]
+    assert all(p["k_link"] == 'auto' and p["workers"] == 1 for p in settings)
+
+    c = SimpleNamespace(n_samples=10, S=2.5, ordering=np.arange(10)[::-1], significances=np.array([np.inf, 4., 3.]),
+                        clusters=np.array([[0, 10], [0, 4], [1, 3]]))
+    summary = summarize(c)
+    assert summary["n_clusters"] == 2 and summary["max_significance"] == 4 and summary["largest_cluster"] == 4
+    assert summary["clustered_fraction"] == 0.4
+
+
+def test_sweep_matches_astrolink():
+    astrolink = pytest.importorskip("astrolink")
+    rng = np.random.default_rng(0)
+    X = np.vstack([rng.normal(0, 1, (300, 2)), rng.normal(6, 0.5, (150, 2)), rng.uniform(-5, 10, (150, 2))])
+    settings = expand_grid({"k_den": 20, "workers": 1, "verbose": 0}, {"k_link": [5, 'auto'], "S": [2, 'auto']})
+    table, results = sweep_astrolink(X, settings)
+    assert len(table) == len(results) == len(settings)
+    # Each row of the sweep is what a separate AstroLink run with its setting gives
+    for j in (0, 3):
+        c = astrolink.AstroLink(X, **settings[j])
+        c.run()
+        assert table.iloc[j]["k_link_used"] == c.k_link
+        assert table.iloc[j]["n_clusters"] == summarize(c)["n_clusters"]
+        assert table.iloc[j]["S_used"] == pytest.approx(summarize(c)["S_used"])
+        np.testing.assert_allclose(results[j].logRho, c.logRho)
+        np.testing.assert_array_equal(results[j].ordering, c.ordering)
+        np.testing.assert_array_equal(results[j].clusters, c.clusters)
+        np.testing.assert_array_equal(results[j].ids, c.ids)
+
+
+def test_cluster_summary():
+    rng = np.random.default_rng(0)
+    n = 1000
+    c = SimpleNamespace(n_samples=n, ordering=rng.permutation(n), clusters=np.array([[0, n], [100, 600], [150, 300], [700, 701]]),
+                        ids=np.array(['1', '1-1', '1-1-1', '1-2']))
+    x, w = rng.normal(size=n), rng.random(n)
+    summary = cluster_summary(c, {"x": x}, weights=w)
+    assert list(summary["id"]) == ['1', '1-1', '1-1-1', '1-2'] and list(summary["count"]) == [n, 500, 150, 1]
+    for row, (s, e) in zip(summary.itertuples(index=False), c.clusters):
+        members = c.ordering[s:e]
+        np.testing.assert_allclose([row[4], row[5], row[6], row[7], row[8]],
+                                   [w[members].sum(), x[members].mean(), x[members].std(), np.median(x[members]),
+                                    np.average(x[members], weights=w[members])], atol=1e-6)
+
+
+def test_cluster_hierarchy():
+    n = 20
+    ordering = np.random.default_rng(0).permutation(n)
+    # Clusters in the order h_style=0 can leave them, children before parents
+    c = SimpleNamespace(n_samples=n, ordering=ordering, clusters=np.array([[0, n], [4, 6], [2, 10], [12, 15], [2, 4]]),
+                        ids=np.array(['1', '1-1-2', '1-1', '1-2', '1-1-1']))
+    h = ClusterHierarchy(c)
+    assert list(h.parent) == [-1, 2, 0, 0, 2] and h.children[0] == [2, 3] and h.children[2] == [4, 1]
+    assert h.ancestors('1-1-2') == [2, 0] and h.size('1-1') == 8
+    np.testing.assert_array_equal(h.members('1-2'), ordering[12:15])
+    assert h.contains('1-1', ordering[9]) and not h.contains('1-1', ordering[10])
+    np.testing.assert_array_equal(h.contains(2, ordering), (np.arange(n) >= 2) & (np.arange(n) < 10))
+
+    labels = h.labels()
+    assert labels.dtype == np.int32
+    np.testing.assert_array_equal(labels[ordering], [0, 0, 4, 4, 1, 1, 2, 2, 2, 2, 0, 0, 3, 3, 3, 0, 0, 0, 0, 0])
+
+
+def test_batch(astrolink_stub, tmp_path):
+    config = {"feature_spaces": [["x", "y"]], "adaptive_list": [1], "k_den_list": [20], "S_list": ['auto'],
+              "k_link_list": ['auto'], "h_style_list": [1], "workers_list": [-1], "verbose_list": [0],
+              "feature_space_name": ["pos"], "columns": ["x", "y", "z"]}
+    with open(tmp_path / "config.json", "w") as f:
+        json.dump(config, f)
+    config = load_config(str(tmp_path / "config.json"))
+    assert config["type_l"] == [] and parse_size("512M") == 2**29 and parse_size("2G") == 2**31
+
+    np.save(tmp_path / "snap_000.npy", np.random.default_rng(0).normal(size=(100, 3)))
+    out = tmp_path / "out"
+    os.makedirs(out)
+    run_file(config, str(tmp_path / "snap_000.npy"), str(out / "snap_000"))
+    results = AstroGlueResults.load(str(out / "snap_000"))
+    assert list(results.master_df.columns) == ["x", "y", "z", "ordered_index_pos", "log_rho_pos", "input order"]
+
+    # Finished files are skipped, and the errors of failed ones are recorded
+    status = run_batch(config, [str(tmp_path / "snap_000.npy"), str(tmp_path / "missing.npy")], str(out), n_jobs=2,
+                       poll_interval=0.05)
+    assert status[str(tmp_path / "snap_000.npy")]["status"] == "skipped"
+    assert status[str(tmp_path / "missing.npy")]["status"] == "failed"
+    assert "No such file" in status[str(tmp_path / "missing.npy")]["error"]
+    with open(out / "batch_status.json") as f:
+        assert json.load(f) == status
+
+    # The columns of a projected .csv file, which also has a text column, are renamed as it is read
+    df = pd.DataFrame(np.random.default_rng(0).normal(size=(100, 3)), columns=["a", "b", "c"])
+    df["name"] = ["star %d" % i for i in range(100)]
+    df.to_csv(tmp_path / "table.csv", index=False)
+    run_file(dict(config, project=True, columns=["x", "y", "z", "name"], var_plot_list=[["name"]],
+                  type_l=["1D Histogram"]), str(tmp_path / "table.csv"), str(out / "table"))
+    results = AstroGlueResults.load(str(out / "table"))
+    assert list(results.master_df.columns) == ["x", "y", "name", "ordered_index_pos", "log_rho_pos", "input order"]
+    np.testing.assert_allclose(results.master_df["x"], df["a"])
+    assert list(results.master_df["name"]) == list(df["name"])
+
+
+def test_compact_precision():
+    rng = np.random.default_rng(0)
+    n = 300
+    data_df = pd.DataFrame(rng.normal(size=(n, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+    ag.set_variables("data.csv", data_df, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [-1], [0], ["pos"], [], [])
+    ag.set_precision()
+    ag.run_astrolink = lambda: ag.astrolink_list.append(fake_astrolink(n, rng))
+    master_df = ag.compute().master_df
+    assert ag.P.dtype == np.float32 and ag.P.flags["F_CONTIGUOUS"]
+    assert set(master_df.dtypes[["x", "y", "z", "log_rho_pos"]]) == {np.dtype(np.float32)}
+    assert set(master_df.dtypes[["ordered_index_pos", "input order"]]) == {np.dtype(np.int32)}
+    np.testing.assert_array_equal(master_df["ordered_index_pos"], ag.astrolink_list[0].ordering.argsort())
+    np.testing.assert_allclose(master_df[["x", "y", "z"]], data_df, rtol=1e-6)
+
+
+def compact_and_default_runs(data_df):
+    """Returns the AstroGlue objects of a default and a compact run on data_df, in that order."""
+    runs = []
+    for compact in (False, True):
+        ag = AstroGlue()
+        ag.set_precision(compact)
+        ag.set_variables("data.csv", data_df, [["x", "y"], ["z"]], [1, 1], [20, 20], ['auto'] * 2, ['auto'] * 2, [1, 1],
+                         [1, 1], [0, 0], ["pos", "z"], [], [])
+        ag.compute()
+        runs.append(ag)
+    return runs
+
+
+def test_compact_astrolink_input(astrolink_stub):
+    data_df = pd.DataFrame(np.random.default_rng(0).normal(size=(300, 3)), columns=["x", "y", "z"])
+    default, compact = compact_and_default_runs(data_df)
+    # The data is stored as float32, but clustered as float64
+    assert compact.P.dtype == np.float32
+    assert [P.dtype for P, _ in astrolink_stub.calls] == [np.dtype(np.float64)] * 4
+
+
+def test_compact_clusters_match_default():
+    pytest.importorskip("astrolink")
+    rng = np.random.default_rng(0)
+    X = np.vstack([rng.normal(0, 1, (300, 3)), rng.normal(5, 0.3, (100, 3)), rng.uniform(-4, 8, (200, 3))])
+    # Values float32 stores exactly, so that only the dtype AstroLink is given differs
+    data_df = pd.DataFrame(X.astype(np.float32).astype(np.float64), columns=["x", "y", "z"])
+    default, compact = compact_and_default_runs(data_df)
+    for a, b in zip(default.astrolink_list, compact.astrolink_list):
+        np.testing.assert_array_equal(a.ordering, b.ordering)
+        np.testing.assert_array_equal(a.clusters, b.clusters)
+
+
+def test_compact_large_integers(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 300
+    data_df = pd.DataFrame(rng.normal(size=(n, 2)), columns=["x", "y"])
+    data_df["flag"] = np.arange(n) % 3
+    data_df["source_id"] = 2**60 + np.arange(n)
+    # float32 rounds these IDs to the same value
+    assert len(np.unique(data_df["source_id"].to_numpy().astype(np.float32))) < n
+
+    ag = AstroGlue()
+    ag.set_precision()
+    ag.set_variables("data.csv", data_df, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [-1], [0], ["pos"], [], [])
+    with pytest.raises(ValueError, match="source_id"):
+        ag.compute()
+
+    path = str(tmp_path / "data.csv")
+    data_df.to_csv(path, index=False)
+    ag = AstroGlue()
+    ag.set_precision()
+    ag.set_projection()
+    ag.set_variables(path, None, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [-1], [0], ["pos"],
+                     [["flag", "x"]], ["2D Scatter Plot (rectilinear)"])
+    ag.run_astrolink = lambda: ag.astrolink_list.append(fake_astrolink(n, rng))
+    ag.compute()
+    # Small integers are stored exactly, and a large ID column is refused rather than rounded
+    np.testing.assert_array_equal(ag.data_df["flag"], data_df["flag"])
+    with pytest.raises(ValueError, match="source_id"):
+        ag.load_columns(["source_id"])
+    assert "source_id" not in ag.data_df.columns
+    assert read_csv_columns(path, ["source_id"], compact=True)["source_id"].dtype == np.int64
+
+
+def test_incremental_rerun(astrolink_stub):
+    rng = np.random.default_rng(0)
+    n = 300
+    data_df = pd.DataFrame(rng.normal(size=(n, 3)), columns=["x", "y", "z"])
+    ag = AstroGlue()
+
+    def set_spaces(feature_spaces, k_den_list, names):
+        m = len(names)
+        ag.set_variables("data.csv", data_df, feature_spaces, [1] * m, k_den_list, ['auto'] * m, ['auto'] * m, [1] * m,
+                         [1] * m, [0] * m, names, [], [])
+
+    set_spaces([["x", "y"], ["z"]], [20, 20], ["pos", "z"])
+    first = ag.compute().master_df
+    assert k_dens(astrolink_stub) == [20, 20] and ag.changed_spaces == ["pos", "z"]
+
+    # Editing one feature space and adding another only clusters those two
+    set_spaces([["x", "y"], ["z"], ["x", "z"]], [20, 30, 20], ["pos", "z", "xz"])
+    done = []
+    ag.space_done = lambda i, c: done.append(i)
+    second = ag.compute().master_df
+    assert k_dens(astrolink_stub) == [20, 20, 30, 20] and ag.changed_spaces == ["z", "xz"]
+    # Kept results are reported straight away, before the changed feature spaces are clustered
+    assert done == [0, 1, 2]
+    ag.space_done = None
+    assert np.shares_memory(second["ordered_index_pos"].to_numpy(), first["ordered_index_pos"].to_numpy())
+    assert len(ag.astrolink_list) == 3 and ag.log_rho_l == ["log_rho_pos", "log_rho_z", "log_rho_xz"]
+
+    # Removing a feature space clusters nothing
+    set_spaces([["x", "z"]], [20], ["xz"])
+    third = ag.compute().master_df
+    assert len(astrolink_stub.calls) == 4 and ag.changed_spaces == []
+    assert list(third.columns) == ["x", "y", "z", "ordered_index_xz", "log_rho_xz", "input order"]
+    np.testing.assert_array_equal(third["log_rho_xz"], second["log_rho_xz"])
+
+
+def test_progress_and_cancel(monkeypatch, astrolink_stub, tmp_path):
+    stages = []
+    run = astrolink_stub.run
+
+    def run_and_cancel(self):
+        run(self)
+        # Cancelled from the GUI while the first feature space is clustered
+        ag.cancel_event.set()
+
+    monkeypatch.setattr(astrolink_stub, "run", run_and_cancel)
+    data_df = pd.DataFrame(np.random.default_rng(0).normal(size=(100, 3)), columns=["x", "y", "z"])
+    data_df.to_csv(tmp_path / "data.csv", index=False)
+    preview = preview_file(str(tmp_path / "data.csv"), n_rows=10)
+    assert list(preview.columns) == ["x", "y", "z"] and len(preview) == 10
+
+    ag = AstroGlue()
+    ag.set_variables("data.csv", data_df, [["x", "y"], ["z"]], [1, 1], [20, 20], ['auto'] * 2, ['auto'] * 2, [1, 1],
+                     [1, 1], [0, 0], ["pos", "z"], [], [])
+    ag.cancel_event = threading.Event()
+    ag.progress = stages.append
+    with pytest.raises(RunCancelled):
+        ag.compute()
+    assert stages == ["load", "key pos", "key z", "AstroLink pos"]
+
+
+def test_instrumentation(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 200
+    data_df = pd.DataFrame(rng.normal(size=(n, 2)), columns=["x", "y"])
+    ag = AstroGlue()
+    ag.set_variables("data.csv", data_df, [["x", "y"]], [1], [20], ['auto'], ['auto'], [1], [-1], [0], ["pos"], [], [])
+    ag.run_astrolink = lambda: ag.astrolink_list.append(fake_astrolink(n, rng))
+    finished = []
+    ag.set_instrumentation(callback=finished.append, trace_path=str(tmp_path / "trace.json"))
+    ag.compute()
+
+    assert [s.name for s in finished] == ["load", "data_prep"]
+    assert all(s.wall >= 0 and s.cpu >= 0 and s.peak_rss > 0 for s in finished)
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)["traceEvents"]
+    assert [e["name"] for e in events] == ["load", "data_prep"] and all(e["ph"] == "X" for e in events)